@@ -1,47 +1,85 @@
+# first, so the startup import phase includes pygame
+from common import BaseSprite, BlitGroup, Clock, DirtyGroup, SpriteCounter, Hooks, NullProfiler, interpolate, surface_cache, startup, tracing
+
 import pygame
 import random
 import time
 import math
+import sys
 
-from common import BaseSprite, FrameCounter
+from tables import velocity
+from config import configure, settings
+from spatial import SpatialHash
 
-max_mass = 2500
-screen_size = (800, 600)
+max_mass = 2500  # at config.base_size, scaled to the screen's area
 
 
 class Star(BaseSprite):
+    __slots__ = ("position", "angle", "speed", "twinkle", "size", "dx", "dy")
     brightness_range = [63, 255]
     containers = []
+    collisions = True
 
     def __init__(self, position, angle, speed, size=3, twinkle=False):
-        BaseSprite.__init__(self, self.containers)
+        self.reset(position, angle, speed, size, twinkle)
+
+        # joined last so the star grid can index the finished rect
+        BaseSprite.__init__(self)
 
+    def reset(self, position, angle, speed, size=3, twinkle=False):
         self.position = position
-        self.angle = angle
         self.speed = speed
         self.twinkle = twinkle
 
+        self.set_angle(angle)
+
         self.rect = pygame.Rect(position, (size, size))
-        self.image = pygame.Surface((size, size))
+        self.image = surface_cache.get_lod("square", size)
         self.size = size
-
-        self.image.fill((255, 255, 255))
+        self.last_update = -1
+
+    @classmethod
+    def spawn_batch(cls, batch):
+        # batch of (position, angle, speed, size, twinkle), all built before
+        # joining each group (and so the star grid) once for the whole batch
+        cls.spawned("stars", len(batch))
+        stars = []
+        for args in batch:
+            star = cls.__new__(cls)
+            pygame.sprite.DirtySprite.__init__(star)
+            star.reset(*args)
+            stars.append(star)
+
+        for group in cls.containers:
+            group.add(*stars)
+        return stars
+
+    def set_angle(self, angle):
+        self.angle = angle
+        self.dx, self.dy = velocity(angle, self.speed)
 
     def set_size(self, size):
+        old_size = self.size
         self.size = size
 
         self.rect.height = self.rect.width = size
-        self.image = pygame.Surface((size, size))
-        self.image.fill((255, 255, 255))
+        self.image = surface_cache.get_lod("square", size)
+        self.dirty = 1
+
+        for group in self.groups():
+            if isinstance(group, Stars):
+                group.resized(self, old_size)
 
     def update_dt(self, dt):
-        if dt == 0:
+        if dt == 0 or not self.alive():
             return
 
         self.dirty = 1
 
         # collision = pygame.sprite.spritecollideany(self, self.containers[0])
         collision = False
+        if self.collisions:
+            collision = self.containers[0].grid.collide(self)
 
         if collision:
             reflection_plane = (self.angle + collision.angle) / 2
@@ -55,6 +93,9 @@ class Star(BaseSprite):
             self.speed = m_avg / self.size**2
             collision.speed = m_avg / collision.size**2
 
+            self.set_angle(self.angle)
+            collision.set_angle(collision.angle)
+
             # combine if small enough
 
             if collision.size + 2 <= self.size:
@@ -63,74 +104,195 @@ class Star(BaseSprite):
 
 
         x, y = self.position
-        x += self.speed * dt * math.cos(math.radians(self.angle))
-        y += self.speed * dt * math.sin(math.radians(self.angle))
+        x += self.dx * dt
+        y += self.dy * dt
         self.rect.center = self.position = (x, y)
+        self.containers[0].grid.move(self)
 
         if self.twinkle:
             b = random.randint(self.brightness_range[0], self.brightness_range[1])
-            self.image.fill((b, b, b))
+            self.image = surface_cache.get_lod("square", self.size, (b, b, b))
 
-        if (x < -self.size / 2 or x > screen_size[0] + self.size / 2) or \
-            (y < -self.size / 2 or y > screen_size[1] + self.size / 2):
+        if (x < -self.size / 2 or x > settings.width + self.size / 2) or \
+            (y < -self.size / 2 or y > settings.height + self.size / 2):
             self.kill()
 
         # print(self.rect.center)
 
 
-class Stars(pygame.sprite.RenderUpdates):
+class Stars(BlitGroup):
+    def __init__(self, *sprites):
+        self.grid = SpatialHash(cell_size=16)
+        self.total_mass = 0
+        BlitGroup.__init__(self, *sprites)
+
+    def add_internal(self, sprite, layer=None):
+        BlitGroup.add_internal(self, sprite, layer)
+        self.grid.insert(sprite)
+        self.total_mass += sprite.size**2
+
+    def remove_internal(self, sprite):
+        BlitGroup.remove_internal(self, sprite)
+        self.grid.remove(sprite)
+        self.total_mass -= sprite.size**2
+
+    def resized(self, sprite, old_size):
+        self.grid.move(sprite)
+        self.total_mass += sprite.size**2 - old_size**2
+
     def get_total_mass(self):
-        total_mass = 0
-        for s in self.sprites():
-            total_mass += s.size**2
-        return total_mass
+        return self.total_mass
 
 
-def make_star():
-    x = random.randint(0, screen_size[0])
-    y = random.randint(0, screen_size[1])
+def random_star():
+    x = random.randint(0, settings.width)
+    y = random.randint(0, settings.height)
 
     # angle = random.randint(0, 360)
-    angle = math.degrees(math.atan2(y - screen_size[1]/2, x - screen_size[0]/2))
+    angle = math.degrees(math.atan2(y - settings.height/2, x - settings.width/2))
 
     size = random.randint(1, 7)
     speed = 20*size
 
-    Star((x, y), angle, speed, size=size, twinkle=False)
+    return (x, y), angle, speed, size, False
 
 
-def main():
-    pygame.init()
-    screen = pygame.display.set_mode(screen_size)
+def make_star():
+    return Star.spawn_batch([random_star()])[0]
+
+
+def make_stars(mass):
+    # spawn at least `mass` worth of stars in one go
+    batch = []
+    while mass > 0:
+        args = random_star()
+        mass -= args[3]**2
+        batch.append(args)
+    return Star.spawn_batch(batch)
+
+
+def make_field_stars(field, mass):
+    # make_star for the array backend, spawning at least `mass` worth at once
+    import numpy as np
+
+    while mass > 0:
+        size = np.random.randint(1, 8, int(mass // 20) + 1)
+        size = size[:np.searchsorted(np.cumsum(size**2), mass) + 1]
+
+        x = np.random.randint(0, settings.width + 1, len(size))
+        y = np.random.randint(0, settings.height + 1, len(size))
+        angle = np.degrees(np.arctan2(y - settings.height/2, x - settings.width/2))
+
+        field.spawn(np.column_stack((x, y)), angle, 20*size, size, 0)
+        Star.spawned("stars", len(size))
+        mass -= int(np.sum(size**2))
+
+
+def main(backend="sprite", render="flip", frames=None, profiler=None, hooks=None):
+    profiler = profiler or NullProfiler()
+    hooks = hooks or Hooks()
+    BaseSprite.profiler = profiler
+
+    pygame.display.init()
+    screen = settings.set_mode()
+    startup.mark("display")
 
     stars = Stars()
     Star.containers.append(stars)
 
-    counter = FrameCounter()
+    if render == "dirty":
+        background = pygame.Surface(screen.get_size())
+        layers = DirtyGroup()
+        layers.clear(screen, background)
+        Star.containers.append(layers)
+    elif render == "flip":
+        layers = None
+    else:
+        raise ValueError("'%s' is not a valid render mode." % render)
+
+    if backend == "sprite":
+        field = None
+    else:
+        from particles import make_particle_system
+        field = make_particle_system(backend, ["#ffffff"], screen.get_rect(), gravity=0, degrade_speed=0, edges="cull")
+
+    counter = SpriteCounter()
+    counter.track_memory("stars", stars if field is None else field)
+
+    target_mass = settings.per_area(max_mass)
+
+    def refill():
+        if field is not None:
+            make_field_stars(field, target_mass - field.total_mass())
+            return
+
+        make_stars(target_mass - stars.get_total_mass())
 
-    while stars.get_total_mass() < max_mass:
-        make_star()
+    refill()
+    startup.mark("setup")
+    clock = Clock()
+    frame = 0
 
     try:
-        while not pygame.event.peek(pygame.QUIT):
+        while not pygame.event.peek(pygame.QUIT) and (frames is None or frame < frames):
+            hooks.begin_frame(frame)
+            profiler.begin_frame()
             pygame.event.poll()
-            while stars.get_total_mass() < max_mass:
-                make_star()
-
-            screen.fill((0, 0, 0))
-
-            stars.update()
-            stars.draw(screen)
-
-            counter.update()
+            profiler.mark("events")
+
+            refill()
+            steps = clock.tick(hooks.frame_time())
+            for step in range(steps):
+                stars.update(clock.dt)
+                if field is not None:
+                    field.update_dt(clock.dt)
+            profiler.mark("update")
+
+            with interpolate(stars, clock.alpha):
+                if layers is None:
+                    screen.fill((0, 0, 0))
+                    stars.draw(screen)
+                else:
+                    rects = layers.draw(screen)
+
+            if field is not None:
+                drawn = field.draw(screen)
+                if layers is not None:
+                    layers.mark(drawn)
+
+            profiler.mark("draw")
+
+            counts = {"stars": len(stars) if field is None else len(field)}
+            profiler.counts(counts)
+            counter.update_counts(counts)
+            counter.update(clock.frame_time)
             # counter.image.blit(screen, counter.rect)
             screen.blit(counter.image, counter.rect)
-            pygame.display.flip()
+            profiler.mark("hud")
+
+            if layers is None:
+                pygame.display.flip()
+            else:
+                layers.mark(counter.rect)
+                layers.present(rects)
+            profiler.mark("present")
+            if frame == 0:
+                startup.mark("first frame")
+                print(startup.text())
+
+            hooks.end_frame(frame, screen)
+            frame += 1
     except KeyboardInterrupt:
         pass
 
+    if field is not None:
+        field.close()
+
+    BaseSprite.profiler = None
     print("Quitting...")
 
 
 if __name__ == "__main__":
-    main()
+    args = configure(sys.argv[1:])[:2]
+    with tracing() as profiler:
+        main(*args, profiler=profiler)
@@ -0,0 +1,128 @@
+import os
+import io
+import hashlib
+import xml.etree.ElementTree as ET
+
+import pygame
+
+import common
+
+cache_dir = os.path.join(common.cache_dir, "assets")
+
+SVG = "http://www.w3.org/2000/svg"
+INKSCAPE = "http://www.inkscape.org/namespaces/inkscape"
+namespaces = {
+    "": SVG,
+    "svg": SVG,
+    "inkscape": INKSCAPE,
+    "sodipodi": "http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "cc": "http://creativecommons.org/ns#",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+}
+for prefix, uri in namespaces.items():
+    if prefix != "svg":
+        ET.register_namespace(prefix, uri)
+
+
+def svg_layers(root):
+    # inkscape layers are the top level groups marked groupmode="layer",
+    # listed back to front
+    return [g for g in root.findall("{%s}g" % SVG) if g.get("{%s}groupmode" % INKSCAPE) == "layer"]
+
+
+def svg_aspect(root):
+    # width/height of the document, from its viewBox if it has one
+    view_box = root.get("viewBox")
+    if view_box:
+        width, height = (float(n) for n in view_box.replace(",", " ").split()[2:4])
+    else:
+        width, height = (float(root.get(name).rstrip("ptxcmin")) for name in ("width", "height"))
+    return width / height
+
+
+def scaled_size(aspect, height):
+    return max(1, round(height * aspect)), height
+
+
+def layer_svg(source, layer_id, size):
+    # the document resized to `size`, with every layer but one hidden. size
+    # keeps the document's aspect ratio (see scaled_size); "none" only
+    # absorbs the rounding, so there's no transparent sliver at the edge
+    root = ET.fromstring(source)
+    root.set("width", str(size[0]))
+    root.set("height", str(size[1]))
+    root.set("preserveAspectRatio", "none")
+
+    for layer in svg_layers(root):
+        style = [rule for rule in (layer.get("style") or "").split(";") if rule and not rule.startswith("display:")]
+        style.append("display:inline" if layer.get("id") == layer_id else "display:none")
+        layer.set("style", ";".join(style))
+
+    return ET.tostring(root)
+
+
+def rasterise(source, layer_id, size):
+    surf = pygame.image.load(io.BytesIO(layer_svg(source, layer_id, size)), "layer.svg")
+    if surf.get_size() != tuple(size):
+        surf = pygame.transform.smoothscale(surf.convert_alpha(), size)
+    return surf
+
+
+def bake_layers(path, height):
+    # Rasterise every layer of an SVG at `height`, keeping its aspect ratio,
+    # caching the pixels on disk keyed by the file's content hash and the
+    # resolution. Cached layers are
+    # stored as raw BGRA, which loads straight into the usual 32 bit display
+    # format without a convert_alpha pass.
+    with open(path, "rb") as f:
+        source = f.read()
+
+    digest = hashlib.sha1(source).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    root = ET.fromstring(source)
+    size = scaled_size(svg_aspect(root), height)
+
+    layers = []
+    for layer in svg_layers(root):
+        layer_id = layer.get("id")
+        cached = os.path.join(cache_dir, "%s-%s-%ix%i-%s.bgra" % (stem, layer_id, size[0], size[1], digest))
+
+        try:
+            with open(cached, "rb") as f:
+                surf = pygame.image.frombytes(f.read(), size, "BGRA")
+        except (OSError, ValueError):
+            data = pygame.image.tobytes(rasterise(source, layer_id, size), "BGRA")
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cached + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(cached + ".tmp", cached)
+            surf = pygame.image.frombytes(data, size, "BGRA")
+
+        layers.append(display_format(surf))
+    return layers
+
+
+def display_format(surf):
+    # only pay for convert_alpha when the display really wants another layout
+    display = pygame.display.get_surface()
+    if display is not None and display.get_bitsize() == 32 and surf.get_masks()[:3] == display.get_masks()[:3]:
+        return surf
+    return surf.convert_alpha()
+
+
+def load_layers(path, height, fallbacks=()):
+    # baked SVG layers, or the hand exported images, `height` tall and as
+    # wide as their aspect ratio makes them; the parallax layers tile
+    # horizontally to fill whatever width the screen has
+    try:
+        return bake_layers(path, height)
+    except pygame.error:
+        if not fallbacks:
+            raise
+    layers = []
+    for f in fallbacks:
+        image = pygame.image.load(f).convert_alpha()
+        size = scaled_size(image.get_width() / image.get_height(), height)
+        layers.append(pygame.transform.smoothscale(image, size))
+    return layers
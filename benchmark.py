@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+
+# must be set before pygame is imported anywhere
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from common import Hooks, Profiler, seed_all, startup  # first, so the import phase includes pygame
+
+import pygame
+
+import config
+import launcher
+from config import settings
+from replay import Replayer
+from launcher import demos, here
+
+
+class ScriptedInput(Hooks):
+    # Stands in for the person at the keyboard: fixed frame times and input
+    # events posted on a fixed schedule from a seeded generator.
+    def __init__(self, demo, seed, fps=60):
+        self.demo = demo
+        self.random = random.Random(seed)
+        self.fps = fps
+
+    def frame_time(self):
+        return 1/self.fps
+
+    def begin_frame(self, frame):
+        if self.demo == "firework" and frame % 30 == 0:
+            # drag out a new Emitter
+            start = (self.random.randint(0, settings.width), self.random.randint(settings.height//2, settings.height))
+            end = (start[0] + self.random.randint(-100, 100), start[1] - self.random.randint(20, 150))
+            pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1, pos=start))
+            pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONUP, button=1, pos=end))
+        elif self.demo == "falling-stars" and frame % 15 == 0:
+            pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_s, unicode="s", mod=0))
+
+
+def run(name, frames, seed, backend="sprite", render="flip", trace=None, target_fps=None, replay=None,
+        sprite_timing=False):
+    seed_all(seed)
+    module = launcher.load_demo(name)
+    profiler = Profiler(trace=trace is not None, sprite_timing=sprite_timing)
+    # a Replayer brings its own seed, and must be made after seed_all
+    hooks = Replayer(replay) if replay else ScriptedInput(name, seed)
+
+    startup.restart()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        launcher.start(name, module, backend, render, target_fps, frames=frames, profiler=profiler, hooks=hooks)
+    wall = time.perf_counter() - start
+
+    result = profiler.report()
+    result["wall_s"] = wall
+    result["fps"] = profiler.frames / wall if wall else 0
+    result["startup_ms"] = startup.report()
+    if trace is not None:
+        profiler.export(trace)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the demos headless and report per-phase timings as JSON.")
+    parser.add_argument("demos", nargs="*", help="any of %s (default: all)" % ", ".join(demos))
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", default="sprite", choices=["sprite", "numpy", "parallel"])
+    parser.add_argument("--render", default="flip", choices=["flip", "dirty"])
+    parser.add_argument("--replay", help="drive the demo from a replay.py log instead of scripted input; "
+                                         "the log decides the demo, backend, render mode and frame count")
+    config.add_arguments(parser)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--sprite-timing", action="store_true",
+                        help="also time each sprite class's updates (sprite_update_ms); this slows the "
+                             "update phase it reports")
+    args = parser.parse_args(argv)
+    config.apply(args)
+    for name in args.demos:
+        if name not in demos:
+            parser.error("unknown demo '%s'" % name)
+    for option in ("output", "replay"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+
+    names = args.demos or list(demos)
+    if args.replay:
+        meta = Replayer(args.replay)
+        names = [meta.metadata["demo"]]
+        args.backend, args.render = meta.metadata["backend"], meta.metadata["render"]
+        args.frames = len(meta)
+        settings.resize(meta.metadata.get("size", settings.size))
+        settings.density = meta.metadata.get("density", settings.density)
+
+    os.chdir(here)  # parallax loads its layers relative to the cwd
+    pygame.display.init()
+
+    report = {
+        "frames": args.frames,
+        "seed": args.seed,
+        "backend": args.backend,
+        "render": args.render,
+        "replay": args.replay,
+        "target_fps": settings.target_fps,
+        "sprite_timing": args.sprite_timing,
+        "size": "%ix%i" % settings.size,
+        "density": settings.density,
+        "pygame": pygame.version.ver,
+        "python": sys.version.split()[0],
+        "import_ms": startup.report()["import"],
+        "demos": {},
+    }
+    for name in names:
+        # --trace comes from the scene options; several demos get a file each
+        trace = settings.trace
+        if trace and len(names) > 1:
+            root, ext = os.path.splitext(trace)
+            trace = "%s-%s%s" % (root, name, ext)
+        report["demos"][name] = run(name, args.frames, args.seed, args.backend, args.render, trace,
+                                  settings.target_fps, args.replay, args.sprite_timing)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,35 @@
-import pygame
-import random
 import time
+started = time.perf_counter()  # before importing pygame, which dominates a cold start
+
+import os
+import sys
+import csv
+import contextlib
+import json
 import math
+import heapq
+import random
+from itertools import compress
+from operator import attrgetter
+from collections import OrderedDict, deque
+
+import pygame
+
+from config import settings
 
-max_mass = 2500
-screen_size = (800, 600)
+here = os.path.dirname(os.path.abspath(__file__))
+cache_dir = os.path.join(here, ".cache")
 
 
 def multiline_font_render(font, text, antialias=True, colour=(255,255,255), justification="left", *args, **kwargs):
-    line_sizes = []
+    lines = [render_line(font, line, antialias, colour, *args, **kwargs) for line in text.split("\n")]
 
-    width = 0
-    height = 0
-    for line in text.split("\n"):
-        size = font.size(line)
-        line_sizes.append(size)
-        width = max(width, size[0])
-        height += size[1]
+    width = max(line_surf.get_width() for line_surf in lines)
+    height = sum(line_surf.get_height() for line_surf in lines)
 
     surf = pygame.Surface((width, height), pygame.SRCALPHA)
     y = 0
-    for line in text.split("\n"):
-        line_surf = font.render(line, antialias, colour, *args, **kwargs)
+    for line_surf in lines:
         if justification == "left":
             line_rect = line_surf.get_rect(left=0, y=y)
         elif justification == "center":
@@ -36,15 +44,162 @@ def multiline_font_render(font, text, antialias=True, colour=(255,255,255), just
         y += line_rect.height
     return surf
 
+
+class LRUCache:
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, factory):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            value = self.entries[key] = factory()
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+
+def draw_square(size, colour):
+    surf = pygame.Surface((size, size))
+    surf.fill(colour)
+    return surf
+
+
+class SurfaceCache(LRUCache):
+    # Sprite images are shared between every sprite of the same shape, size
+    # bucket and colour, so never draw onto a surface you got from here.
+    def __init__(self, capacity=512):
+        LRUCache.__init__(self, capacity)
+        self.shapes = {"square": draw_square}
+
+    def register(self, shape, draw):
+        self.shapes[shape] = draw
+
+    def get_surface(self, shape, size, colour=(255, 255, 255)):
+        size = max(0, int(size))
+        colour = tuple(colour)
+        return self.get((shape, size, colour), lambda: self.shapes[shape](size, colour))
+
+    def get_lod(self, shape, size, colour=(255, 255, 255)):
+        # get_surface, with detail the sprite is too small to show dropped:
+        # a single pixel (which BlitGroup writes without a blit) below
+        # settings.pixel_lod, a square below settings.shape_lod. Sprites
+        # keep their full size rect, so collisions don't change; BlitGroup
+        # and DirtyGroup both draw the pixel at the rect's centre. Anything
+        # under a pixel still gets one rather than vanishing.
+        size = max(1, int(size))
+        if size < settings.pixel_lod:
+            return self.get_surface("square", 1, colour)
+        if size < settings.shape_lod:
+            shape = "square"
+        return self.get_surface(shape, size, colour)
+
+
+surface_cache = SurfaceCache()
+line_cache = LRUCache(capacity=256)
+
+
+def render_line(font, line, antialias=True, colour=(255,255,255), *args, **kwargs):
+    # only lines that actually changed since last time get rendered again
+    key = (font, line, antialias, tuple(colour), args, tuple(sorted(kwargs.items())))
+    return line_cache.get(key, lambda: font.render(line, antialias, colour, *args, **kwargs))
+
+
+fonts = {}
+
+
+def find_font(name):
+    # match_font scans every installed font, which is slow on machines with
+    # lots of them, so remember the answer on disk between runs
+    font_file = os.path.join(cache_dir, "fonts.json")
+    try:
+        with open(font_file) as f:
+            paths = json.load(f)
+    except (OSError, ValueError):
+        paths = {}
+
+    path = paths.get(name, "")
+    if path is None or (path and os.path.exists(path)):
+        return path
+
+    path = paths[name] = pygame.font.match_font(name)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(font_file, "w") as f:
+            json.dump(paths, f)
+    except OSError:
+        pass
+    return path
+
+
+def load_font(name, size):
+    # None is pygame's bundled default, same as SysFont falls back to
+    key = (name, size)
+    if key not in fonts:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        fonts[key] = pygame.font.Font(find_font(name), size)
+    return fonts[key]
+
+
+def seed_all(seed):
+    random.seed(seed)
+    try:
+        import numpy
+    except ImportError:
+        return
+    numpy.random.seed(seed)
+
+
 class BaseSprite(pygame.sprite.DirtySprite):
+    # The __slots__ here and in subclasses only take these attributes out of
+    # the instance __dict__; pygame's Sprite still gives every sprite one for
+    # its own state. Measured with tracemalloc that saves about 8 of ~490
+    # bytes a sprite, so memory_report is the number to size against.
+    __slots__ = ("last_update", "prev_position", "image", "rect")
     containers = []
+    profiler = None  # a main loop's Profiler while one is running
+    governor = None  # likewise its QualityGovernor
     def __init__(self, *args, **kwargs):
-        pygame.sprite.Sprite.__init__(self, self.containers, *args, **kwargs)
+        pygame.sprite.DirtySprite.__init__(self, self.containers, *args, **kwargs)
         self.last_update = -1
 
-    def update(self):
+    def update(self, dt=None):
+        profiler = self.profiler
+        if profiler is None or not profiler.sprite_timing:
+            self._update(dt)
+            return
+
+        start = time.perf_counter()
+        self._update(dt)
+        profiler.sprite_update(type(self).__name__, time.perf_counter() - start)
+
+    @classmethod
+    def spawned(cls, name, n=1):
+        if cls.profiler is not None:
+            cls.profiler.spawned(name, n)
+
+    def _update(self, dt):
         pygame.sprite.Sprite.update(self)
 
+        if dt is not None:
+            # stepped by a Clock: everyone gets the same dt, no clock reads
+            self.prev_position = getattr(self, "position", None)
+            self.update_dt(dt)
+            return
+
         cur_time = time.time()
 
         if self.last_update == -1:
@@ -57,55 +212,653 @@ class BaseSprite(pygame.sprite.DirtySprite):
     def update_dt(self, dt):
         pass
 
+def sprite_bytes(sprite):
+    # the sprite object plus everything it holds directly, except its image,
+    # which is usually shared through surface_cache
+    values = []
+    total = sys.getsizeof(sprite)
+    if hasattr(sprite, "__dict__"):
+        total += sys.getsizeof(sprite.__dict__)
+        values.extend(sprite.__dict__.values())
+    for cls in type(sprite).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if name != "image" and hasattr(sprite, name):
+                values.append(getattr(sprite, name))
+
+    for value in values:
+        if isinstance(value, pygame.Surface) or value is None or isinstance(value, bool):
+            continue
+        total += sys.getsizeof(value)
+        if isinstance(value, tuple):
+            total += sum(sys.getsizeof(item) for item in value)
+    return total
+
+
+def memory_report(sprites, sample=64):
+    # (bytes per entity, total bytes) for a group or list of sprites, or
+    # anything array backed that knows its row size and its nbytes. For
+    # arrays the total is the whole allocation, live or not. Per-sprite size
+    # is estimated from a sample; images are counted once per distinct
+    # surface.
+    if hasattr(sprites, "nbytes"):
+        return sprites.row_bytes, sprites.nbytes
+
+    sprites = list(sprites)
+    if not sprites:
+        return 0, 0
+
+    picked = sprites[::max(1, len(sprites) // sample)]
+    per_entity = sum(sprite_bytes(sprite) for sprite in picked) / len(picked)
+
+    images = {id(sprite.image): sprite.image for sprite in sprites if getattr(sprite, "image", None) is not None}
+    image_bytes = sum(image.get_width() * image.get_height() * image.get_bytesize() for image in images.values())
+
+    return per_entity, per_entity * len(sprites) + image_bytes
+
+
+class Clock:
+    # Fixed timestep scheduler. tick() reads the time once per frame and
+    # says how many steps of exactly `dt` the simulation owes; whatever is
+    # left over becomes `alpha`, how far rendering sits between two steps.
+    def __init__(self, tick_rate=60, max_steps=5):
+        self.dt = 1/tick_rate
+        self.max_steps = max_steps
+        self.accumulator = 0
+        self.frame_time = 0
+        self.alpha = 0
+        self.last_time = None
+
+    def tick(self, frame_time=None):
+        cur_time = time.perf_counter()
+        if frame_time is None:
+            frame_time = 0 if self.last_time is None else cur_time - self.last_time
+        self.last_time = cur_time
+        self.frame_time = frame_time
+
+        self.accumulator += frame_time
+        steps = int(self.accumulator / self.dt)
+        if steps > self.max_steps:
+            # hopelessly behind, drop the backlog instead of spiralling
+            steps = self.max_steps
+            self.accumulator = steps * self.dt
+        self.accumulator -= steps * self.dt
+
+        self.alpha = self.accumulator / self.dt
+        return steps
+
+
+@contextlib.contextmanager
+def interpolate(sprites, alpha):
+    # draw stepped sprites `alpha` of the way from their last position:
+    # rects are moved for the draws inside the with block and put back
+    # after, so collisions and the spatial hash only see simulated rects
+    moved = []
+    for sprite in sprites:
+        prev = getattr(sprite, "prev_position", None)
+        if prev is None or prev == sprite.position:
+            continue
+        rect = sprite.rect
+        moved.append((rect, rect.topleft))
+        x, y = sprite.position
+        rect.center = (prev[0] + (x - prev[0]) * alpha, prev[1] + (y - prev[1]) * alpha)
+        if not sprite.dirty:
+            sprite.dirty = 1
+    try:
+        yield
+    finally:
+        for rect, topleft in moved:
+            rect.topleft = topleft
+
+
+class Profiler:
+    # Wall time per main loop phase. Call begin_frame() at the top of the
+    # loop and mark(phase) at the end of each phase; a phase is charged the
+    # time since the previous mark. With trace on, every frame's phases and
+    # spawn counts are also kept for export_chrome()/export_csv(). Timing
+    # every sprite's update is opt-in with sprite_timing: it adds two clock
+    # reads per sprite, which shows up in the "update" phase.
+    def __init__(self, trace=False, sprite_timing=False, trace_frames=36000):
+        self.sprite_timing = sprite_timing
+        self.frames = 0
+        self.totals = {}
+        self.peaks = {}
+        self.sprite_totals = {}
+        self.spawn_totals = {}
+        self.last = None
+        self.origin = time.perf_counter()
+        self.trace = deque(maxlen=trace_frames) if trace else None
+        self.frame = None
+
+    def begin_frame(self):
+        self.frames += 1
+        self.last = time.perf_counter()
+        if self.trace is not None:
+            self.frame = (self.frames - 1, self.last, [], {})
+            self.trace.append(self.frame)
+
+    def mark(self, phase):
+        cur_time = time.perf_counter()
+        self.totals[phase] = self.totals.get(phase, 0) + cur_time - self.last
+        if self.frame is not None:
+            self.frame[2].append((phase, self.last, cur_time - self.last))
+        self.last = cur_time
+
+    def counts(self, counts):
+        for name, count in counts.items():
+            if count > self.peaks.get(name, 0):
+                self.peaks[name] = count
+
+    def sprite_update(self, name, seconds):
+        # BaseSprite.update time, split by sprite class
+        self.sprite_totals[name] = self.sprite_totals.get(name, 0) + seconds
+
+    def spawned(self, name, n=1):
+        self.spawn_totals[name] = self.spawn_totals.get(name, 0) + n
+        if self.frame is not None:
+            spawns = self.frame[3]
+            spawns[name] = spawns.get(name, 0) + n
+
+    def report(self):
+        frames = max(self.frames, 1)
+        return {
+            "frames": self.frames,
+            "phases": {
+                phase: {"total_ms": total*1000, "per_frame_ms": total*1000/frames}
+                for phase, total in self.totals.items()
+            },
+            "sprite_update_ms": {name: total*1000 for name, total in self.sprite_totals.items()},
+            "spawned": dict(self.spawn_totals),
+            "peak_counts": dict(self.peaks),
+        }
+
+    def export(self, path):
+        if path.endswith(".csv"):
+            self.export_csv(path)
+        else:
+            self.export_chrome(path)
+
+    def export_chrome(self, path):
+        # trace event format, loads in chrome://tracing and Perfetto
+        events = []
+        for frame, start, phases, spawns in self.trace or ():
+            ts = (start - self.origin) * 1e6
+            end = phases[-1][1] + phases[-1][2] if phases else start
+            events.append({"name": "frame", "ph": "X", "pid": 1, "tid": 1, "ts": ts,
+                           "dur": (end - start) * 1e6, "args": {"frame": frame}})
+            for phase, phase_start, duration in phases:
+                events.append({"name": phase, "ph": "X", "pid": 1, "tid": 1,
+                               "ts": (phase_start - self.origin) * 1e6, "dur": duration * 1e6})
+            if spawns:
+                events.append({"name": "spawned", "ph": "C", "pid": 1, "tid": 1, "ts": ts, "args": spawns})
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def export_csv(self, path):
+        # one row per frame, a column per phase (ms) and per spawn counter
+        trace = self.trace or ()
+        phase_names, spawn_names = [], []
+        for frame, start, phases, spawns in trace:
+            for phase, phase_start, duration in phases:
+                if phase not in phase_names:
+                    phase_names.append(phase)
+            for name in spawns:
+                if name not in spawn_names:
+                    spawn_names.append(name)
+
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", "start_ms"] + ["%s_ms" % phase for phase in phase_names]
+                            + ["spawned_%s" % name for name in spawn_names])
+            for frame, start, phases, spawns in trace:
+                durations = {}
+                for phase, phase_start, duration in phases:
+                    durations[phase] = durations.get(phase, 0) + duration
+                writer.writerow([frame, "%.3f" % ((start - self.origin) * 1000)]
+                                + ["%.3f" % (durations.get(phase, 0) * 1000) for phase in phase_names]
+                                + [spawns.get(name, 0) for name in spawn_names])
+
+
+class NullProfiler:
+    sprite_timing = False
+
+    def begin_frame(self):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    def counts(self, counts):
+        pass
+
+    def sprite_update(self, name, seconds):
+        pass
+
+    def spawned(self, name, n=1):
+        pass
+
+
+@contextlib.contextmanager
+def tracing():
+    # a tracing Profiler for a run if --trace/BOREDOM_TRACE asked for one
+    # (otherwise None), exported when the block exits
+    if not settings.trace:
+        yield None
+        return
+    profiler = Profiler(trace=True)
+    try:
+        yield profiler
+    finally:
+        profiler.export(settings.trace)
+        sys.stderr.write("trace written to %s\n" % settings.trace)
+
+
+class StartupTimer:
+    # Like Profiler but for the one-off work before the first frame: each
+    # mark(phase) is charged the time since the previous mark.
+    def __init__(self, start=None):
+        self.start = self.last = start or time.perf_counter()
+        self.phases = OrderedDict()
+
+    def restart(self):
+        self.start = self.last = time.perf_counter()
+        self.phases = OrderedDict()
+
+    def mark(self, phase):
+        cur_time = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + cur_time - self.last
+        self.last = cur_time
+
+    def report(self):
+        return OrderedDict((phase, total*1000) for phase, total in self.phases.items())
+
+    def text(self):
+        return "startup %.0fms (%s)" % ((self.last - self.start)*1000,
+                                        ", ".join("%s %.0fms" % item for item in self.report().items()))
+
+
+class Hooks:
+    # Extension points for driving a demo from outside its main loop, e.g.
+    # scripted input for benchmarks. frame_time() returning None means the
+    # Clock measures real time.
+    def begin_frame(self, frame):
+        pass
+
+    def frame_time(self):
+        return None
+
+    def end_frame(self, frame, screen):
+        pass
+
+
+class BlitGroup(pygame.sprite.RenderUpdates):
+    # RenderUpdates drawn with one Surface.blits call instead of a blit per
+    # sprite, with opaque 1x1 images written straight into the target's
+    # pixels afterwards, so they land on top. A pixel goes at the centre of
+    # its sprite's rect, which may be larger (see SurfaceCache.get_lod).
+    # Per-sprite work stays in map()/compress() rather than Python loops.
+    # The dirty list it returns covers the same area, without merging each
+    # sprite's old and new rects.
+    pixel_writes = True  # needs numpy; everything is blitted without it
+    max_colours = 1024
+
+    def __init__(self, *sprites):
+        pygame.sprite.RenderUpdates.__init__(self, *sprites)
+        self.pixel_colours = {}
+        self.pixel_format = None
+        self.pixel_evictions = None
+
+    def pixel_colour(self, image, surface):
+        # mapped colour if image is a single opaque pixel, otherwise -1
+        if image.get_size() != (1, 1):
+            return -1
+        colour = image.get_at((0, 0))
+        if colour.a != 255 or colour == image.get_colorkey():
+            return -1
+        return surface.map_rgb(colour)
+
+    def draw(self, surface, bgsurf=None, special_flags=0):
+        sprites = self.sprites()
+        if self.pixel_writes and not special_flags and surface.get_bytesize() != 3:
+            try:
+                import numpy as np
+            except ImportError:
+                self.pixel_writes = False
+        if not self.pixel_writes or special_flags or surface.get_bytesize() == 3 or not sprites:
+            rects = surface.blits([(sprite.image, sprite.rect, None, special_flags) for sprite in sprites])
+            return self.track(sprites, rects)
+
+        fmt = (surface.get_bitsize(), surface.get_masks())
+        # images are keys, so start over whenever surface_cache has let
+        # some go, rather than keep them alive here
+        if fmt != self.pixel_format or len(self.pixel_colours) > self.max_colours \
+                or surface_cache.evictions != self.pixel_evictions:
+            self.pixel_colours = {}
+            self.pixel_format = fmt
+            self.pixel_evictions = surface_cache.evictions
+        colours = self.pixel_colours
+
+        images = list(map(attrgetter("image"), sprites))
+        distinct = set(images)
+        for image in distinct.difference(colours):
+            colours[image] = self.pixel_colour(image, surface)
+        if all(colours[image] < 0 for image in distinct):
+            rects = surface.blits([(sprite.image, sprite.rect) for sprite in sprites])
+            return self.track(sprites, rects)
+
+        colour = np.fromiter(map(colours.__getitem__, images), np.int64, len(images))
+        tiny = colour >= 0
+
+        blitted = list(compress(sprites, ~tiny))
+        rects = surface.blits([(sprite.image, sprite.rect) for sprite in blitted])
+
+        pixels = list(compress(sprites, tiny))
+        if pixels:
+            drawn = list(map(pygame.Rect.copy, map(attrgetter("rect"), pixels)))
+            x = np.fromiter(map(attrgetter("centerx"), drawn), np.intp, len(drawn))
+            y = np.fromiter(map(attrgetter("centery"), drawn), np.intp, len(drawn))
+            colour = colour[tiny]
+
+            clip = surface.get_clip()
+            inside = (x >= clip.left) & (x < clip.right) & (y >= clip.top) & (y < clip.bottom)
+            view = pygame.surfarray.pixels2d(surface)
+            view[x[inside], y[inside]] = colour[inside]
+            del view  # unlocks the surface
+
+            blitted += pixels
+            rects += drawn
+
+        return self.track(blitted, rects)
+
+    def track(self, sprites, rects):
+        dirty = self.lostsprites
+        self.lostsprites = []
+        dirty.extend(filter(None, self.spritedict.values()))
+        dirty.extend(rects)
+        self.spritedict.update(zip(sprites, rects))
+        return dirty
+
+
+class DirtyGroup(pygame.sprite.LayeredDirty):
+    # LayeredDirty that decides between dirty rects and a full redraw before
+    # drawing, from the area this frame has to repaint. Merging the dirty
+    # rects is O(n**2) in LayeredDirty, so busy scenes skip it altogether:
+    # they repaint the whole background, blit every sprite and flip.
+    # share of the screen above which one flip beats display.update(rects)
+    flip_threshold = 0.35
+    max_rects = 128  # dirty rects above which merging them costs more than a redraw
+
+    def __init__(self, *sprites, **kwargs):
+        pygame.sprite.LayeredDirty.__init__(self, *sprites, **kwargs)
+        self.marked = []
+        self.full = False
+
+    def mark(self, rect):
+        # for things blitted straight onto the screen after draw(), like the
+        # HUD or particles: presented now and repainted from the background
+        # on the next draw()
+        self.marked.append(pygame.Rect(rect))
+
+    def needs_full_redraw(self, screen_rect):
+        # Too much area to repaint, or too many rects to merge. The area is
+        # an overestimate: overlaps count twice, and every dirty sprite
+        # repaints both where it was and where it is.
+        moved = [sprite.rect for sprite in self._spritelist if sprite.dirty]
+        if 2 * len(moved) + len(self.lostsprites) > self.max_rects:
+            return True
+        area = sum(rect.width * rect.height for rect in self.lostsprites)
+        area += 2 * sum(rect.width * rect.height for rect in moved)
+        return area > screen_rect.width * screen_rect.height * self.flip_threshold
+
+    def draw(self, surface, bgsurf=None, special_flags=None):
+        for rect in self.marked:
+            self.repaint_rect(rect)
+        self.marked = []
+
+        screen_rect = surface.get_rect()
+        self.full = self.needs_full_redraw(screen_rect)
+        self._use_update = not self.full  # LayeredDirty's own switch, normally timed
+
+        # single pixel images standing in for bigger sprites (see
+        # SurfaceCache.get_lod) go at the centre of the rect, as BlitGroup
+        # puts them, rather than at its top left
+        pixels = [sprite for sprite in self._spritelist if sprite.rect.width > 1 and sprite.image.get_width() == 1]
+        full_rects = [sprite.rect for sprite in pixels]
+        for sprite, rect in zip(pixels, full_rects):
+            sprite.rect = pygame.Rect(rect.center, (1, 1))
+        try:
+            rects = pygame.sprite.LayeredDirty.draw(self, surface, bgsurf, special_flags)
+        finally:
+            for sprite, rect in zip(pixels, full_rects):
+                sprite.rect = rect
+        if self.full:
+            # the full redraw leaves dirty flags alone
+            for sprite in self._spritelist:
+                if sprite.dirty == 1:
+                    sprite.dirty = 0
+        return rects
+
+    def present(self, rects):
+        if self.full:
+            pygame.display.flip()
+            return
+
+        rects = rects + self.marked
+        screen_rect = pygame.display.get_surface().get_rect()
+        area = sum(r.width * r.height for r in rects)
+
+        if area > screen_rect.width * screen_rect.height * self.flip_threshold:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+
+
+class QualityGovernor:
+    # Holds a frame rate under load by scaling back spawning and capping the
+    # live particle population. Frame time is measured here with the wall
+    # clock rather than taken from the Clock, which may be fed scripted
+    # times. Overload cuts quickly, recovery is gradual, and the band
+    # between target and target*slack is left alone, so frames jittering
+    # around a vsync paced target don't count as overload.
+    smoothing = 0.1
+    slack = 1.1
+    cut = 0.9
+    recover = 0.02
+    min_scale = 0.05
+
+    def __init__(self, target_fps=60):
+        self.target = 1/target_fps
+        self.scale = 1.0
+        self.cap = None
+        self.frame_time = self.target
+        self.last_time = None
+
+    def update(self):
+        cur_time = time.perf_counter()
+        if self.last_time is not None:
+            self.frame_time += (cur_time - self.last_time - self.frame_time) * self.smoothing
+        self.last_time = cur_time
+
+    def overloaded(self):
+        return self.frame_time > self.target * self.slack
+
+    def adjust(self, live):
+        # once per frame with the live population; returns how many to shed
+        if self.overloaded():
+            self.scale = max(self.min_scale, self.scale * self.cut)
+            self.cap = int(min(live, self.cap or live) * self.cut)
+        elif self.frame_time <= self.target:
+            self.scale = min(1.0, self.scale + self.recover)
+            if self.cap is not None:
+                self.cap = int(self.cap * (1 + self.recover)) + 1
+                if self.scale == 1.0 and self.cap > live * 2:
+                    self.cap = None
+        return 0 if self.cap is None else max(0, live - self.cap)
+
+    def allow(self):
+        # for one-at-a-time spawns: True `scale` of the time
+        return self.scale == 1.0 or random.random() < self.scale
+
+    def scaled(self, n):
+        if self.scale == 1.0:
+            return n
+        return int(n * self.scale + random.random())
+
+    def shed(self, population):
+        # smallest first; debris shrinks as it ages, so that's also oldest
+        # first. population is a sprite group or a ParticleSystem.
+        excess = self.adjust(len(population))
+        if not excess:
+            return 0
+        if hasattr(population, "cull"):
+            population.cull(excess)
+        else:
+            for sprite in heapq.nsmallest(excess, population, key=lambda sprite: sprite.size):
+                sprite.kill()
+        return excess
+
+
+class FrameStats:
+    # Ring buffer of recent frame times. Sums over the trailing windows are
+    # kept up to date as samples come and go, and a fixed-width histogram of
+    # the whole buffer gives percentiles in a bounded number of steps.
+    bucket_width = 0.0005  # 0.5ms
+    bucket_count = 200  # anything slower than 100ms shares the last bucket
+
+    def __init__(self, size=600, windows=(60, 120, 600)):
+        self.times = [0.0]*size
+        self.index = 0
+        self.count = 0
+        self.windows = windows
+        self.sums = [0.0]*len(windows)
+        self.histogram = [0]*self.bucket_count
+
+    def _bucket(self, dt):
+        return min(int(dt / self.bucket_width), self.bucket_count - 1)
+
+    def add(self, dt):
+        times = self.times
+        size = len(times)
+        index = self.index
+
+        for i, window in enumerate(self.windows):
+            self.sums[i] += dt - times[(index - window) % size]
+
+        if self.count == size:
+            self.histogram[self._bucket(times[index])] -= 1
+        else:
+            self.count += 1
+        self.histogram[self._bucket(dt)] += 1
+
+        times[index] = dt
+        self.index = (index + 1) % size
+
+        if self.index == 0:
+            # resync once per lap so float error can't build up
+            self.sums = [sum(times[-window:]) for window in self.windows]
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        target = p / 100 * self.count
+        seen = 0
+        for bucket, n in enumerate(self.histogram):
+            seen += n
+            if seen >= target:
+                return (bucket + 1) * self.bucket_width
+        return self.bucket_count * self.bucket_width
+
+
 class FrameCounter(BaseSprite):
     containers = []
+    refresh_rate = 4  # overlay redraws per second, None to redraw every frame
+    font_name = "Ubuntu Mono"
+    font_size = 12
+    hidden = False  # keep counting but never draw, e.g. for video export
 
     def __init__(self):
         BaseSprite.__init__(self)
-        self.draw_times = [0]*600
+        self.stats = FrameStats(600, (60, 120, 600))
+        self.since_refresh = 0
 
         self.avg_60f = 0
         self.avg_120f = 0
         self.avg_600f = 0
+        self.p50 = self.p95 = self.p99 = 0
         self.frame = 0
 
-        self.font = pygame.font.SysFont("Ubuntu Mono", 12)
-        self.update_image()
+        # the font is only loaded when the first refresh draws some text
+        self.image = pygame.Surface((0, 0))
+        self.rect = self.image.get_rect(topright=(settings.width, 0))
+
+    @property
+    def font(self):
+        return load_font(self.font_name, self.font_size)
 
     def update_dt(self, dt):
-        self.draw_times.append(dt)
-        self.draw_times = self.draw_times[-600:-1] + [self.draw_times[-1]]
+        self.stats.add(dt)
+        sum_60f, sum_120f, sum_600f = self.stats.sums
 
-        if sum(self.draw_times[-60:-1]) == 0:
+        if sum_60f == 0 or self.hidden:
             return
 
         self.frame += 1
-        self.avg_60f = 60/sum(self.draw_times[-60:-1] + [self.draw_times[-1]])
-        self.avg_120f = 120/sum(self.draw_times[-120:-1] + [self.draw_times[-1]])
-        self.avg_600f = 600/sum(self.draw_times[-600:-1] + [self.draw_times[-1]])
+        self.since_refresh += dt
+        if self.refresh_rate and self.since_refresh < 1/self.refresh_rate:
+            return
+        self.since_refresh = 0
+
+        self.avg_60f = 60/sum_60f
+        self.avg_120f = 120/sum_120f
+        self.avg_600f = 600/sum_600f
+
+        self.p50 = self.stats.percentile(50)
+        self.p95 = self.stats.percentile(95)
+        self.p99 = self.stats.percentile(99)
 
         self.update_image()
 
+    def timing_text(self):
+        return "\n%.1fms/p50\n%.1fms/p95\n%.1fms/p99" % (self.p50*1000, self.p95*1000, self.p99*1000)
 
     def update_image(self):
         text = "%i\n%.0f/60\n%.0f/120\n%.0f/600" % (self.frame, self.avg_60f, self.avg_120f, self.avg_600f)
+        text += self.timing_text()
         # self.image = self.font.render(text, True, (255,255,255))
         self.image = multiline_font_render(self.font, text, justification="right")
-        self.rect = self.image.get_rect(topright=(screen_size[0], 0))
+        self.rect = self.image.get_rect(topright=(settings.width, 0))
+        self.dirty = 1
 
 
 class SpriteCounter(FrameCounter):
-    def __init__(self):
+    def __init__(self, governor=None):
         self.counts = {}
+        self.tracked = {}
+        self.governor = governor
         FrameCounter.__init__(self)
 
     def update_counts(self, counts):
         self.counts = counts
 
+    def track_memory(self, name, sprites):
+        # sampled on overlay redraws only, so it stays off the per-frame path
+        self.tracked[name] = sprites
+
     def update_image(self):
         text = "%i/frame\n%.0f/60\n%.0f/120\n%.0f/600" % (self.frame, self.avg_60f, self.avg_120f, self.avg_600f)
+        text += self.timing_text()
         for name, count in self.counts.items():
             text += "\n%i/%s" % (count, name)
+        for name, sprites in self.tracked.items():
+            per_entity, total = memory_report(sprites)
+            text += "\n%iB/%s\n%.0fKB/%s" % (per_entity, name, total/1024, name)
+        if self.governor is not None:
+            text += "\n%.0f%%/quality" % (self.governor.scale * 100)
 
         self.image = multiline_font_render(self.font, text, justification="right")
-        self.rect = self.image.get_rect(topright=(screen_size[0], 0))
+        self.rect = self.image.get_rect(topright=(settings.width, 0))
+        self.dirty = 1
+
+
+startup = StartupTimer(started)
+startup.mark("import")
@@ -0,0 +1,144 @@
+import os
+import sys
+import argparse
+
+import pygame
+
+base_size = (800, 600)  # the size the scenes were tuned at
+
+
+# Scene settings shared by every demo: window size and mode, plus density,
+# which together decide how big populations get, the level of detail
+# thresholds for small sprites, the quality governor's target and where
+# to write a frame trace. Defaults come from BOREDOM_* environment
+# variables and can be overridden on the command line.
+class Settings:
+    def __init__(self, size=base_size, fullscreen=False, vsync=False, density=1.0, pixel_lod=4, shape_lod=6,
+                 target_fps=None, trace=None):
+        self.fullscreen = fullscreen
+        self.vsync = vsync
+        self.density = density
+        self.pixel_lod = pixel_lod  # anything smaller is drawn as a single pixel
+        self.shape_lod = shape_lod  # anything smaller is drawn as a plain square
+        self.target_fps = target_fps  # None leaves the quality governor off
+        self.trace = trace  # path for common.tracing(), or None
+        self.resize(size)
+
+    def resize(self, size):
+        self.size = tuple(size)
+        self.width, self.height = self.size
+
+    @property
+    def area_scale(self):
+        return self.width * self.height / (base_size[0] * base_size[1]) * self.density
+
+    @property
+    def zoom(self):
+        # for things that should cover the same fraction of the screen
+        return self.width / base_size[0]
+
+    def per_area(self, value):
+        # a population target tuned at base_size, for this screen
+        return value * self.area_scale
+
+    def display_flags(self):
+        # HWSURFACE does nothing in pygame 2. SCALED puts the window behind
+        # an SDL renderer: the only way to get vsync without OpenGL, and the
+        # GPU upscales a smaller logical size in fullscreen instead of the
+        # display switching modes.
+        flags = 0
+        if self.fullscreen:
+            flags |= pygame.FULLSCREEN | pygame.DOUBLEBUF
+            desktop = pygame.display.get_desktop_sizes()[0]
+            if self.size != tuple(desktop):
+                flags |= pygame.SCALED
+        if self.vsync:
+            flags |= pygame.SCALED
+        return flags
+
+    def set_mode(self):
+        flags = self.display_flags()
+        try:
+            screen = pygame.display.set_mode(self.size, flags, vsync=int(self.vsync))
+        except pygame.error as e:
+            # no vsync (or no renderer) on this driver; a plain window still works
+            if self.fullscreen or self.vsync:
+                sys.stderr.write("warning: %s, falling back to a plain window without fullscreen or vsync\n" % e)
+            screen = pygame.display.set_mode(self.size)
+            self.fullscreen = self.vsync = False
+        self.resize(screen.get_size())
+        return screen
+
+
+def parse_size(text):
+    try:
+        width, height = (int(n) for n in text.lower().split("x"))
+    except ValueError:
+        raise ValueError("'%s' is not a valid size, use WIDTHxHEIGHT." % text)
+    return width, height
+
+
+def from_env(environ=os.environ):
+    return Settings(
+        size=parse_size(environ.get("BOREDOM_SIZE", "%ix%i" % base_size)),
+        fullscreen=environ.get("BOREDOM_FULLSCREEN", "") not in ("", "0"),
+        vsync=environ.get("BOREDOM_VSYNC", "") not in ("", "0"),
+        density=float(environ.get("BOREDOM_DENSITY", 1)),
+        pixel_lod=int(environ.get("BOREDOM_PIXEL_LOD", 4)),
+        shape_lod=int(environ.get("BOREDOM_SHAPE_LOD", 6)),
+        target_fps=float(environ["BOREDOM_TARGET_FPS"]) if environ.get("BOREDOM_TARGET_FPS") else None,
+        trace=os.path.abspath(environ["BOREDOM_TRACE"]) if environ.get("BOREDOM_TRACE") else None,
+    )
+
+
+settings = from_env()
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("scene")
+    group.add_argument("--size", type=parse_size, help="window size as WIDTHxHEIGHT (BOREDOM_SIZE)")
+    group.add_argument("--fullscreen", action="store_true", default=None, help="(BOREDOM_FULLSCREEN)")
+    group.add_argument("--vsync", action="store_true", default=None, help="(BOREDOM_VSYNC)")
+    group.add_argument("--density", type=float, help="population multiplier on top of the area scaling "
+                                                     "(BOREDOM_DENSITY)")
+    group.add_argument("--pixel-lod", type=int, help="sprites smaller than this are drawn as one pixel "
+                                                     "(BOREDOM_PIXEL_LOD)")
+    group.add_argument("--shape-lod", type=int, help="sprites smaller than this are drawn as squares, "
+                                                     "whatever their shape (BOREDOM_SHAPE_LOD)")
+    group.add_argument("--target-fps", type=float, help="shed particles to hold this frame rate; pick one a "
+                                                        "little below the display's refresh rate "
+                                                        "(BOREDOM_TARGET_FPS, default: off)")
+    group.add_argument("--trace", help="write a per-frame trace here, as CSV if it ends in .csv, otherwise "
+                                       "Chrome trace-event JSON (BOREDOM_TRACE)")
+
+
+def apply(args):
+    if args.size is not None:
+        settings.resize(args.size)
+    if args.fullscreen is not None:
+        settings.fullscreen = args.fullscreen
+    if args.vsync is not None:
+        settings.vsync = args.vsync
+    if args.density is not None:
+        settings.density = args.density
+    if args.pixel_lod is not None:
+        settings.pixel_lod = args.pixel_lod
+    if args.shape_lod is not None:
+        settings.shape_lod = args.shape_lod
+    if args.target_fps is not None:
+        settings.target_fps = args.target_fps
+    if args.trace is not None:
+        settings.trace = os.path.abspath(args.trace)
+
+
+def configure(argv):
+    # for the demos' own entry points: apply any scene options and hand back
+    # the rest (backend and render mode)
+    parser = argparse.ArgumentParser(add_help=False)
+    add_arguments(parser)
+    args, rest = parser.parse_known_args(argv)
+    unknown = [arg for arg in rest if arg.startswith("-")]
+    if unknown:
+        parser.error("unrecognized arguments: %s" % " ".join(unknown))
+    apply(args)
+    return rest
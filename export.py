@@ -0,0 +1,271 @@
+import os
+import sys
+import queue
+import argparse
+import threading
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# must be set before pygame is imported anywhere
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from common import FrameCounter, Hooks, seed_all, tracing  # first, so the import phase includes pygame
+
+import pygame
+
+import config
+from config import settings
+import launcher
+from benchmark import ScriptedInput
+from replay import Replayer
+
+
+class FrameWriter(Hooks):
+    # Steps the demo at a fixed 1/fps regardless of how long frames take to
+    # render, hands each finished frame to write(), and passes input through
+    # from another Hooks (scripted or a replay log). With recorded_times the
+    # demo is stepped by the frame times `hooks` gives instead, as recorded,
+    # and each rendered frame fills every output slot up to its own time, so
+    # the output still runs at fps: slow frames repeat, fast ones drop out.
+    recorded_times = False
+
+    def __init__(self, fps=60, hooks=None):
+        self.fps = fps
+        self.hooks = hooks or Hooks()
+        self.frames = 0
+        self.elapsed = 0
+
+    def begin_frame(self, frame):
+        self.hooks.begin_frame(frame)
+
+    def frame_time(self):
+        if not self.recorded_times:
+            return 1/self.fps
+        frame_time = self.hooks.frame_time()
+        self.elapsed += frame_time
+        return frame_time
+
+    def end_frame(self, frame, screen):
+        self.hooks.end_frame(frame, screen)
+        if self.recorded_times:
+            due = int(self.elapsed * self.fps + 1e-6) + 1
+        else:
+            due = self.frames + 1
+        while self.frames < due:
+            self.write(self.frames, screen)
+            self.frames += 1
+
+    def write(self, frame, screen):
+        pass
+
+    def close(self):
+        pass
+
+
+class PipeWriter(FrameWriter):
+    # Raw RGB24 frames into a file object, e.g. an encoder's stdin. The copy
+    # out of the surface happens here; a writer thread does the blocking
+    # writes, so the encoder runs while the next frame simulates. If the
+    # reader goes away the thread stops and the next write or close raises.
+    timeout = 1.0  # between checks on the writer thread while the queue is full
+
+    def __init__(self, out, fps=60, hooks=None, backlog=8):
+        FrameWriter.__init__(self, fps, hooks)
+        self.out = out
+        self.error = None
+        self.reported = False
+        self.queue = queue.Queue(maxsize=backlog)
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            try:
+                self.out.write(data)
+            except (OSError, ValueError) as e:
+                self.error = e
+                break
+
+    def check(self):
+        # raises once, so close() after a failed write() doesn't repeat it
+        if self.error is not None and not self.reported:
+            self.reported = True
+            raise OSError(self.failure())
+
+    def failure(self):
+        return "frame output closed early: %s" % self.error
+
+    def write(self, frame, screen):
+        data = pygame.image.tobytes(screen, "RGB")
+        while True:
+            self.check()
+            try:
+                self.queue.put(data, timeout=self.timeout)
+                return
+            except queue.Full:
+                pass
+
+    def close(self):
+        while self.error is None and self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=self.timeout)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+        self.check()
+        if self.out is not None:
+            self.out.flush()
+
+
+class EncoderWriter(PipeWriter):
+    # PipeWriter into a shell command, started on the first frame once the
+    # screen size is known. {size} and {fps} in the command are filled in.
+    def __init__(self, command, fps=60, hooks=None, backlog=8):
+        PipeWriter.__init__(self, None, fps, hooks, backlog)
+        self.command = command
+        self.process = None
+
+    def failure(self):
+        if self.process is None:
+            return PipeWriter.failure(self)
+        return "encoder '%s' exited with code %s before all frames were written" % (self.command, self.process.wait())
+
+    def write(self, frame, screen):
+        if self.process is None:
+            size = "%ix%i" % screen.get_size()
+            self.process = subprocess.Popen(self.command.format(size=size, fps=self.fps),
+                                            shell=True, stdin=subprocess.PIPE)
+            self.out = self.process.stdin
+        PipeWriter.write(self, frame, screen)
+
+    def close(self):
+        try:
+            PipeWriter.close(self)
+        finally:
+            if self.process is not None:
+                try:
+                    self.process.stdin.close()
+                except OSError:
+                    pass
+                self.process.wait()
+
+
+class PNGWriter(FrameWriter):
+    # Numbered PNGs encoded on a thread pool. At most `backlog` frames wait
+    # to be saved, which bounds memory when encoding is slower than drawing.
+    def __init__(self, pattern, fps=60, hooks=None, workers=None, backlog=None):
+        FrameWriter.__init__(self, fps, hooks)
+        self.pattern = pattern
+        workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(backlog or workers * 2)
+        self.errors = []
+
+    def _save(self, surface, path):
+        try:
+            pygame.image.save(surface, path)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.slots.release()
+
+    def write(self, frame, screen):
+        self.slots.acquire()
+        self.pool.submit(self._save, screen.copy(), self.pattern % frame)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render a demo to files or a pipe at a fixed timestep, as fast as it will go.",
+        epilog="e.g. export.py firework --seconds 600 "
+               "--size 1920x1080 --pipe 'ffmpeg -f rawvideo -pix_fmt rgb24 -s {size} -r {fps} -i - loop.mp4'")
+    parser.add_argument("demo", choices=list(launcher.demos))
+    length = parser.add_mutually_exclusive_group()
+    length.add_argument("--frames", type=int, help="frames to render (default: 600, or all of a --replay log)")
+    length.add_argument("--seconds", type=float)
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--backend", default="sprite", choices=["sprite", "numpy", "parallel"])
+    parser.add_argument("--render", default="flip", choices=["flip", "dirty"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", help="play back a replay.py log of the same demo instead of the benchmark's "
+                                         "script; the log decides the size, density, backend and render mode")
+    parser.add_argument("--hud", action="store_true", help="keep the frame counter overlay")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--pipe", help="shell command to stream raw RGB24 frames into ({size} and {fps} "
+                                       "are filled in), or - for stdout")
+    output.add_argument("--png", help="directory to write frame-000000.png, ... into")
+    parser.add_argument("--workers", type=int, help="PNG encoder threads (default: one per CPU)")
+    config.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.target_fps is not None:
+        parser.error("--target-fps doesn't apply, frames are rendered at a fixed timestep however long they take")
+    config.apply(args)
+
+    inputs = None
+    if args.replay:
+        inputs = Replayer(args.replay)
+        meta = inputs.metadata
+        if meta["demo"] != args.demo:
+            parser.error("'%s' is a replay of %s, not %s" % (args.replay, meta["demo"], args.demo))
+        args.backend, args.render = meta["backend"], meta["render"]
+        settings.resize(meta.get("size", settings.size))
+        settings.density = meta.get("density", settings.density)
+
+    if args.seconds is not None:
+        frames = int(args.seconds * args.fps)
+    elif args.frames is not None or inputs is None:
+        frames = 600 if args.frames is None else args.frames
+    else:
+        frames = len(inputs)
+    if args.png:
+        args.png = os.path.abspath(args.png)
+        os.makedirs(args.png, exist_ok=True)
+
+    # stdout may be carrying frames, so anything the demo prints goes to stderr
+    stdout = sys.stdout.buffer
+    os.chdir(launcher.here)
+    pygame.display.init()
+
+    seed_all(args.seed if inputs is None else inputs.seed)
+    module = launcher.load_demo(args.demo)
+    if inputs is None:
+        inputs = ScriptedInput(args.demo, args.seed, args.fps)
+    FrameCounter.hidden = not args.hud
+
+    if args.png:
+        writer = PNGWriter(os.path.join(args.png, "frame-%06i.png"), args.fps, inputs, args.workers)
+    elif args.pipe == "-":
+        writer = PipeWriter(stdout, args.fps, inputs)
+    else:
+        writer = EncoderWriter(args.pipe, args.fps, inputs)
+    # a replay keeps its recorded frame times, so it takes the same steps
+    writer.recorded_times = args.replay is not None
+
+    try:
+        try:
+            with contextlib.redirect_stdout(sys.stderr), tracing() as profiler:
+                launcher.start(args.demo, module, args.backend, args.render, target_fps=None, frames=frames,
+                               hooks=writer, profiler=profiler)
+        finally:
+            writer.close()
+    except OSError as e:
+        # the encoder went away
+        sys.exit("export.py: %s" % e)
+
+    sys.stderr.write("wrote %i frames\n" % writer.frames)
+
+
+if __name__ == "__main__":
+    main()
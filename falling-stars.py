@@ -1,15 +1,18 @@
+# first, so the startup import phase includes pygame
+from common import SpriteCounter, BaseSprite, BlitGroup, QualityGovernor, Clock, DirtyGroup, Hooks, NullProfiler, interpolate, surface_cache, startup, tracing
+
 import pygame
 import random
 import time
 import math
+import sys
 
-from common import SpriteCounter, BaseSprite
+from config import configure, settings
+from tables import velocity
 
-max_mass = 2500
-screen_size = (800, 600)
 
 
-def draw_star(points, size, point_length=0.5):
+def draw_star(points, size, point_length=0.5, colour=(255,255,255)):
     polygon = []
     for n in range(points*2):
         if n % 2 == 0:
@@ -23,16 +26,21 @@ def draw_star(points, size, point_length=0.5):
 
     surf = pygame.Surface((size, size), pygame.SRCALPHA)
     # surf.fill((255,0,0))
-    pygame.draw.polygon(surf, (255,255,255), polygon, 0)
+    pygame.draw.polygon(surf, colour, polygon, 0)
     return surf
 
 
+surface_cache.register("star", lambda size, colour: draw_star(5, size, colour=colour))
+
+
 class Star(BaseSprite):
+    __slots__ = ("position", "angle", "speed", "twinkle", "size", "orig_size", "dx", "dy")
     brightness_range = [63, 255]
     containers = []
 
     debris_count = 10 # on avg, debris emitted per second
     explode_debris_count = 20
+    particles = None  # set to a ParticleSystem to bypass Debris sprites
 
     def __init__(self, position, angle, speed, size=3, twinkle=False):
         BaseSprite.__init__(self)
@@ -46,15 +54,14 @@ class Star(BaseSprite):
 
         self.rect = pygame.Rect(position, (size, size))
         # self.image = pygame.Surface((0,0))
-        self.image = draw_star(5, size)
+        self.image = surface_cache.get_lod("star", size)
         self.orig_size = size
         self.size = size
 
         # self.image.fill((255, 255, 255))
     def set_angle(self, angle):
         self.angle = angle
-        self.dx = self.speed * math.cos(math.radians(self.angle))
-        self.dy = self.speed * math.sin(math.radians(self.angle))
+        self.dx, self.dy = velocity(angle, self.speed)
 
     def set_size(self, size):
         temp = self.size
@@ -63,34 +70,56 @@ class Star(BaseSprite):
         self.rect.height = self.rect.width = size
         self.rect.center = self.position
 
-        if int(self.size) != int(temp) or True:
-            self.image = draw_star(5, self.size)
+        if int(self.size) != int(temp):
+            self.image = surface_cache.get_lod("star", self.size)
+            self.dirty = 1
             # self.image.fill((255, 255, 255))
 
     def kill(self):
         BaseSprite.kill(self)
-        if self.explode_debris_count:
-            for n in range(self.explode_debris_count):
+        if self.explode_debris_count and self.particles is not None:
+            import numpy as np
+            n = self.explode_debris_count
+            if self.governor is not None:
+                n = self.governor.scaled(n)
+            self.spawned("debris", n)
+            top = self.orig_size//3 if self.orig_size >= 3 else 1
+            self.particles.spawn(
+                self.position,
+                np.random.randint(0, 361, n),
+                np.random.randint(100, 201, n),
+                np.random.randint(1, top + 1, n),
+                0
+            )
+        elif self.explode_debris_count:
+            burst = []
+            count = self.explode_debris_count
+            if self.governor is not None:
+                count = self.governor.scaled(count)
+            for n in range(count):
                 # angle = random.randint(0, 360)
                 angle = random.randint(0, 360)
 
                 size = random.randint(1, self.orig_size//3) if self.orig_size >= 3 else 1
                 speed = random.randint(100, 200)
 
-                Debris(self.position, angle, speed, size=size, twinkle=False)
+                burst.append((self.position, angle, speed, size, False))
+            Debris.spawn_batch(burst)
 
     def update_dt(self, dt):
         if dt == 0:
             return
 
-        if self.debris_count and (dt * random.random() * self.debris_count > dt/self.debris_count):
-            Debris(
-                self.position,
-                self.angle+random.randint(180-int(self.size)*5,180+int(self.size)*5),
-                self.speed/2-10+random.random()*20,
-                size=self.size/3-1+random.random()*2,
-                twinkle=self.twinkle
-            )
+        if self.debris_count and (dt * random.random() * self.debris_count > dt/self.debris_count) \
+                and (self.governor is None or self.governor.allow()):
+            angle = self.angle+random.randint(180-int(self.size)*5,180+int(self.size)*5)
+            speed = self.speed/2-10+random.random()*20
+            size = self.size/3-1+random.random()*2
+            if self.particles is not None:
+                self.particles.spawn(self.position, angle, speed, size, 0)
+                self.spawned("debris")
+            else:
+                Debris.spawn_batch([(self.position, angle, speed, size, self.twinkle)])
             self.set_size(self.size - 0.01)
 
         if self.size < 1:
@@ -106,17 +135,17 @@ class Star(BaseSprite):
         if self.twinkle:
             self.dirty = 1
             b = random.randint(self.brightness_range[0], self.brightness_range[1])
-            self.image.fill((b, b, b))
+            self.image = surface_cache.get_lod("star", self.size, (b, b, b))
 
 
         update_angle = False
         if (self.rect.left < 0 and self.dx < 0) \
-          or (self.rect.right > screen_size[0] and self.dx > 0):
+          or (self.rect.right > settings.width and self.dx > 0):
             self.dx *= -1
             update_angle = True
 
         if (self.rect.top < 0 and self.dy < 0) \
-          or (self.rect.bottom > screen_size[1] and self.dy > 0):
+          or (self.rect.bottom > settings.height and self.dy > 0):
             self.dy *= -1
             update_angle = True
 
@@ -127,33 +156,71 @@ class Star(BaseSprite):
 
 
 class Debris(Star):
+    __slots__ = ()
     degrade_speed = 3
     containers = []
     debris_count = 0
     explode_debris_count = 0
 
+    pool = []  # killed Debris waiting to be reset and reused
+    max_pool = 2048
+
     def __init__(self, position, angle, speed, size=3, twinkle=False):
         BaseSprite.__init__(self)
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.reset(position, angle, speed, size, twinkle)
 
+    def reset(self, position, angle, speed, size=3, twinkle=False):
         self.position = position
         self.speed = speed
         self.twinkle = twinkle
 
         self.set_angle(angle)
 
-        self.rect = pygame.Rect(position, (size, size))
-        self.image = pygame.Surface((size, size))
+        self.rect.update(position, (size, size))
         # self.image = draw_star(5, size)
-
-        self.image.fill((255,255,255))
+        self.image = surface_cache.get_lod("square", size)
         self.size = size
 
+        # a recycled sprite mustn't be drawn partway back to where it died
+        self.prev_position = None
+        self.last_update = -1
+        self.dirty = 1
+
+    @classmethod
+    def spawn_batch(cls, batch):
+        # batch of (position, angle, speed, size, twinkle); recycles pooled
+        # Debris where it can and joins each group once for the whole batch
+        cls.spawned("debris", len(batch))
+        spawned = []
+        for args in batch:
+            if cls.pool:
+                debris = cls.pool.pop()
+            else:
+                debris = cls.__new__(cls)
+                pygame.sprite.DirtySprite.__init__(debris)
+                debris.rect = pygame.Rect(0, 0, 0, 0)
+            debris.reset(*args)
+            spawned.append(debris)
+
+        for group in cls.containers:
+            group.add(*spawned)
+        return spawned
+
+    def kill(self):
+        if not self.alive():
+            return
+        BaseSprite.kill(self)
+        if len(self.pool) < self.max_pool:
+            self.pool.append(self)
+
     def update_dt(self, dt):
         prev_size = self.size
 
         self.size -= self.degrade_speed * dt
         if self.size < 1:
             self.kill()
+            return
         elif int(prev_size) != int(self.size):
             self.update_image()
 
@@ -166,51 +233,81 @@ class Debris(Star):
         Star.update_dt(self, dt)
 
     def update_image(self):
-        self.image = pygame.Surface((self.size, self.size))
-        self.image.fill((255, 255, 255))
+        self.image = surface_cache.get_lod("square", self.size)
+        self.dirty = 1
 
 
 def make_star():
-    x = random.randint(0, screen_size[0])
-    y = random.randint(0, screen_size[1])
+    x = random.randint(0, settings.width)
+    y = random.randint(0, settings.height)
 
     angle = random.randint(0, 360)
-    # angle = math.degrees(math.atan2(y - screen_size[1]/2, x - screen_size[0]/2))
+    # angle = math.degrees(math.atan2(y - settings.height/2, x - settings.width/2))
 
     size = random.randint(5, 20)
     speed = random.randint(100, 200)
 
     Star((x, y), angle, speed, size=size, twinkle=False)
-
-
-def main():
-    pygame.init()
-    screen = pygame.display.set_mode(screen_size)
-
-    all_sprites = pygame.sprite.RenderUpdates()
+    Star.spawned("stars")
+
+
+def main(backend="sprite", render="flip", frames=None, profiler=None, hooks=None, target_fps=None):
+    profiler = profiler or NullProfiler()
+    hooks = hooks or Hooks()
+    BaseSprite.profiler = profiler
+    governor = BaseSprite.governor = QualityGovernor(target_fps) if target_fps else None
+
+    pygame.display.init()
+    screen = settings.set_mode()
+    startup.mark("display")
+
+    dirty = render == "dirty"
+    if dirty:
+        background = pygame.Surface(screen.get_size())
+        all_sprites = DirtyGroup()
+        all_sprites.clear(screen, background)
+    elif render == "flip":
+        all_sprites = BlitGroup()
+    else:
+        raise ValueError("'%s' is not a valid render mode." % render)
     stars = pygame.sprite.RenderUpdates()
     debris = pygame.sprite.RenderUpdates()
 
     Star.containers = [stars, all_sprites]
     Debris.containers = [debris, all_sprites]
 
-    for z in range(1):
+    if backend == "sprite":
+        particles = None
+    else:
+        from particles import make_particle_system
+        particles = Star.particles = make_particle_system(backend, ["#ffffff"], screen.get_rect(), gravity=0)
+
+    # one star per press at config.base_size, more on bigger screens
+    stars_per_press = max(1, int(round(settings.per_area(1))))
+
+    for z in range(stars_per_press):
         make_star()
         # Star((200,200), 45, 0, size=200)
 
-    counter = SpriteCounter()
+    counter = SpriteCounter(governor)
+    counter.track_memory("debris", debris if particles is None else particles)
+    startup.mark("setup")
+    clock = Clock()
+    frame = 0
 
     try:
-        while not pygame.event.peek(pygame.QUIT):
+        while not pygame.event.peek(pygame.QUIT) and (frames is None or frame < frames):
+            hooks.begin_frame(frame)
+            profiler.begin_frame()
             # pygame.event.poll()
 
             for event in pygame.event.get(pygame.KEYDOWN):
                 if event.unicode == "s":
-                    make_star()
+                    for z in range(stars_per_press):
+                        make_star()
 
             pygame.event.clear()
-
-            screen.fill((0, 0, 0))
+            profiler.mark("events")
 
             # stars.update()
             # stars.draw(screen)
@@ -226,23 +323,63 @@ def main():
             #         dangle = angle - star.angle
             #         star.set_angle(star.angle + dangle * 0.01)
 
-            all_sprites.update()
-            all_sprites.draw(screen)
-
-            counter.update_counts({
-                "debris": len(debris),
+            steps = clock.tick(hooks.frame_time())
+            for step in range(steps):
+                all_sprites.update(clock.dt)
+                if particles is not None:
+                    particles.update_dt(clock.dt)
+            if governor is not None:
+                governor.update()
+                governor.shed(debris if particles is None else particles)
+            profiler.mark("update")
+
+            if not dirty:
+                screen.fill((0, 0, 0))
+            with interpolate(all_sprites, clock.alpha):
+                rects = all_sprites.draw(screen)
+
+            if particles is not None:
+                drawn = particles.draw(screen)
+                if dirty:
+                    all_sprites.mark(drawn)
+
+            profiler.mark("draw")
+
+            counts = {
+                "debris": len(debris) if particles is None else len(particles),
                 "stars": len(stars),
                 "all": len(all_sprites)
-            })
-            counter.update()
+            }
+            profiler.counts(counts)
+            counter.update_counts(counts)
+            counter.update(clock.frame_time)
 
             screen.blit(counter.image, counter.rect)
-            pygame.display.flip()
+            profiler.mark("hud")
+
+            if dirty:
+                all_sprites.mark(counter.rect)
+                all_sprites.present(rects)
+            else:
+                pygame.display.flip()
+            profiler.mark("present")
+            if frame == 0:
+                startup.mark("first frame")
+                print(startup.text())
+
+            hooks.end_frame(frame, screen)
+            frame += 1
     except KeyboardInterrupt:
         pass
 
+    if particles is not None:
+        particles.close()
+
+    BaseSprite.profiler = BaseSprite.governor = None
     print("Quitting...")
 
 
 if __name__ == "__main__":
-    main()
+    args = configure(sys.argv[1:])[:2]
+    with tracing() as profiler:
+        main(*args, profiler=profiler, target_fps=settings.target_fps)
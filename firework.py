@@ -1,12 +1,15 @@
+# first, so the startup import phase includes pygame
+from common import SpriteCounter, BaseSprite, BlitGroup, QualityGovernor, Clock, DirtyGroup, Hooks, NullProfiler, interpolate, surface_cache, startup, tracing
+
 import pygame
 import random
 import time
 import math
+import sys
 
-from common import SpriteCounter, BaseSprite
+from config import configure, settings
+from tables import Palette, velocity
 
-max_mass = 2500
-screen_size = (800, 600)
 colours = [
     "#8e946eff",
     "#795e55ff",
@@ -34,12 +37,15 @@ colours = [
     "#f28e7fff"
 ]
 
+palette = Palette(colours)
+
+
 def get_random_colour():
-    i = random.randint(0, len(colours) - 1)
-    return pygame.Color(colours[i])
+    return palette.random()
 
 
 class Debris(BaseSprite):
+    __slots__ = ("position", "angle", "speed", "colour", "size", "dx", "dy")
     degrade_speed = 3
     containers = []
     debris_count = 0
@@ -47,23 +53,45 @@ class Debris(BaseSprite):
 
     def __init__(self, position, angle, speed, size=3, colour=(255, 255, 255)):
         BaseSprite.__init__(self)
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.reset(position, angle, speed, size, colour)
 
+    def reset(self, position, angle, speed, size=3, colour=(255, 255, 255)):
         self.position = position
         self.speed = speed
         self.colour = colour
 
         self.set_angle(angle)
 
-        self.rect = pygame.Rect(position, (size, size))
-        self.image = pygame.Surface((size, size))
+        self.rect.update(position, (size, size))
         # self.image = draw_star(5, size)
-        self.image.fill(colour)
+        self.image = surface_cache.get_lod("square", size, colour)
         self.size = size
 
+        # not stepped yet, so interpolate() has nothing to draw it back from
+        self.prev_position = None
+        self.last_update = -1
+        self.dirty = 1
+
+    @classmethod
+    def spawn_batch(cls, batch):
+        # batch of (position, angle, speed, size, colour), joining each
+        # group once for the whole batch
+        spawned = []
+        for args in batch:
+            debris = cls.__new__(cls)
+            pygame.sprite.DirtySprite.__init__(debris)
+            debris.rect = pygame.Rect(0, 0, 0, 0)
+            debris.reset(*args)
+            spawned.append(debris)
+
+        for group in cls.containers:
+            group.add(*spawned)
+        return spawned
+
     def set_angle(self, angle):
         self.angle = angle
-        self.dx = self.speed * math.cos(math.radians(self.angle))
-        self.dy = self.speed * math.sin(math.radians(self.angle))
+        self.dx, self.dy = velocity(angle, self.speed)
 
     def update_dt(self, dt):
         prev_size = self.size
@@ -92,12 +120,12 @@ class Debris(BaseSprite):
 
         update_angle = False
         if (self.rect.left < 0 and self.dx < 0) \
-          or (self.rect.right > screen_size[0] and self.dx > 0):
+          or (self.rect.right > settings.width and self.dx > 0):
             self.dx *= -1
             update_angle = True
 
         if (self.rect.top < 0 and self.dy < 0) \
-          or (self.rect.bottom > screen_size[1] and self.dy > 0):
+          or (self.rect.bottom > settings.height and self.dy > 0):
             self.dy *= -1
             update_angle = True
 
@@ -105,38 +133,93 @@ class Debris(BaseSprite):
             self.angle = math.degrees(math.atan2(self.dy, self.dx))
 
     def update_image(self):
-        self.image = pygame.Surface((self.size, self.size))
-        self.image.fill(self.colour)
+        self.image = surface_cache.get_lod("square", self.size, self.colour)
+        self.dirty = 1
 
 
 class Emitter(BaseSprite):
+    # Emits `rate` particles a second for `lifetime` seconds (None for ever).
+    # With burst > 1 they come out `burst` at a time, rate/burst times a
+    # second, each batch drawn in one go.
+    __slots__ = ("position", "angle", "emit_speed_range", "rate", "burst", "lifetime", "age", "due")
     containers = []
+    particles = None  # set to a ParticleSystem to bypass Debris sprites
 
-    def __init__(self, position, angle, emit_speed_range=(100, 500)):
+    def __init__(self, position, angle, emit_speed_range=(100, 500), rate=None, burst=1, lifetime=8):
         BaseSprite.__init__(self)
         self.position = position
         self.angle = angle
         self.emit_speed_range = emit_speed_range
+        self.rate = settings.per_area(60) if rate is None else rate
+        self.burst = burst
+        self.lifetime = lifetime
+        self.age = 0
+        self.due = 0
 
-        self.image = pygame.Surface((5,5))
-        self.image.fill((255,255,255))
+        self.image = surface_cache.get_surface("square", 5)
 
         self.rect = self.image.get_rect(center=self.position)
+        self.spawned("emitters")
 
     def update_dt(self, dt):
-        speed = random.randint(*self.emit_speed_range)
-        size = random.randint(1, 5)
-        angle = self.angle + random.randint(-30, 30)
-        colour = get_random_colour()
-
-        Debris(self.position, angle, speed, size=size, colour=colour)
-
-
-def main():
-    pygame.init()
-    screen = pygame.display.set_mode(screen_size)
-
-    all_sprites = pygame.sprite.RenderUpdates()
+        self.age += dt
+        if self.lifetime is not None and self.age >= self.lifetime:
+            self.kill()
+            return
+
+        self.due += self.rate * dt
+        n = int(self.due // self.burst) * self.burst
+        if not n:
+            return
+        self.due -= n
+
+        if self.governor is not None:
+            n = self.governor.scaled(n)
+        if n:
+            self.emit(n)
+
+    def emit(self, n):
+        self.spawned("debris", n)
+        low, high = self.emit_speed_range
+
+        if self.particles is not None:
+            import numpy as np
+            self.particles.spawn(
+                self.position,
+                self.angle + np.random.randint(-30, 31, n),
+                np.random.randint(low, high + 1, n),
+                np.random.randint(1, 6, n),
+                np.random.randint(0, len(palette), n)
+            )
+            return
+
+        rand = random.random
+        Debris.spawn_batch([
+            (self.position, self.angle + rand()*60 - 30, low + rand()*(high - low),
+             int(rand()*5) + 1, palette.random())
+            for i in range(n)
+        ])
+
+
+def main(backend="sprite", render="flip", frames=None, profiler=None, hooks=None, target_fps=None):
+    profiler = profiler or NullProfiler()
+    hooks = hooks or Hooks()
+    BaseSprite.profiler = profiler
+    governor = BaseSprite.governor = QualityGovernor(target_fps) if target_fps else None
+
+    pygame.display.init()
+    screen = settings.set_mode()
+    startup.mark("display")
+
+    dirty = render == "dirty"
+    if dirty:
+        background = pygame.Surface(screen.get_size())
+        all_sprites = DirtyGroup()
+        all_sprites.clear(screen, background)
+    elif render == "flip":
+        all_sprites = BlitGroup()
+    else:
+        raise ValueError("'%s' is not a valid render mode." % render)
     # stars = pygame.sprite.RenderUpdates()
     fworks = pygame.sprite.RenderUpdates()
     debris = pygame.sprite.RenderUpdates()
@@ -145,14 +228,26 @@ def main():
     Emitter.containers = [fworks, all_sprites]
     Debris.containers = [debris, all_sprites]
 
+    if backend == "sprite":
+        particles = None
+    else:
+        from particles import make_particle_system
+        particles = Emitter.particles = make_particle_system(backend, palette, screen.get_rect())
+
     # Emitter((200,200), -90)
 
-    counter = SpriteCounter()
+    counter = SpriteCounter(governor)
+    counter.track_memory("debris", debris if particles is None else particles)
 
     start_point = (0, 0)
+    startup.mark("setup")
+    clock = Clock()
+    frame = 0
 
     try:
-        while not pygame.event.peek(pygame.QUIT):
+        while not pygame.event.peek(pygame.QUIT) and (frames is None or frame < frames):
+            hooks.begin_frame(frame)
+            profiler.begin_frame()
             # pygame.event.poll()
 
             for event in pygame.event.get(pygame.KEYDOWN):
@@ -160,41 +255,89 @@ def main():
                     make_star()
 
             for event in pygame.event.get(pygame.MOUSEBUTTONDOWN):
-                if event.button == 1:
+                if event.button in (1, 3):
                     start_point = event.pos
 
             for event in pygame.event.get(pygame.MOUSEBUTTONUP):
-                if event.button == 1:
+                if event.button in (1, 3):
                     dx = event.pos[0] - start_point[0]
                     dy = event.pos[1] - start_point[1]
                     max_speed = int(math.sqrt(dy**2 + dx**2))*10
-                    Emitter((start_point), math.degrees(math.atan2(dy, dx)), emit_speed_range=(max_speed//5, max_speed))
+                    angle = math.degrees(math.atan2(dy, dx))
+                    if event.button == 1:
+                        Emitter((start_point), angle, emit_speed_range=(max_speed//5, max_speed))
+                    else:
+                        # right drag: a short run of big bursts
+                        Emitter((start_point), angle, emit_speed_range=(max_speed//5, max_speed),
+                                rate=settings.per_area(400), burst=100, lifetime=1)
 
 
             pygame.event.clear()
-
-            screen.fill((0, 0, 0))
-
-            all_sprites.update()
-            all_sprites.draw(screen)
-
-            if pygame.mouse.get_pressed()[0]:
-                pygame.draw.aaline(screen, (255,0,255), start_point, pygame.mouse.get_pos())
-
-            counter.update_counts({
-                "debris": len(debris),
+            profiler.mark("events")
+
+            steps = clock.tick(hooks.frame_time())
+            for step in range(steps):
+                all_sprites.update(clock.dt)
+                if particles is not None:
+                    particles.update_dt(clock.dt)
+            if governor is not None:
+                governor.update()
+                governor.shed(debris if particles is None else particles)
+            profiler.mark("update")
+
+            if not dirty:
+                screen.fill((0, 0, 0))
+            with interpolate(all_sprites, clock.alpha):
+                rects = all_sprites.draw(screen)
+
+            if particles is not None:
+                drawn = particles.draw(screen)
+                if dirty:
+                    all_sprites.mark(drawn)
+
+            pressed = pygame.mouse.get_pressed()
+            if pressed[0] or pressed[2]:
+                line = pygame.draw.aaline(screen, (255,0,255), start_point, pygame.mouse.get_pos())
+                if dirty:
+                    all_sprites.mark(line)
+
+            profiler.mark("draw")
+
+            counts = {
+                "debris": len(debris) if particles is None else len(particles),
                 "stars": len(fworks),
                 "all": len(all_sprites)
-            })
-            counter.update()
+            }
+            profiler.counts(counts)
+            counter.update_counts(counts)
+            counter.update(clock.frame_time)
 
             screen.blit(counter.image, counter.rect)
-            pygame.display.flip()
+            profiler.mark("hud")
+
+            if dirty:
+                all_sprites.mark(counter.rect)
+                all_sprites.present(rects)
+            else:
+                pygame.display.flip()
+            profiler.mark("present")
+            if frame == 0:
+                startup.mark("first frame")
+                print(startup.text())
+
+            hooks.end_frame(frame, screen)
+            frame += 1
     except KeyboardInterrupt:
         pass
 
+    if particles is not None:
+        particles.close()
+
+    BaseSprite.profiler = BaseSprite.governor = None
     print("Quitting...")
 
 
 if __name__ == "__main__":
-    main()
+    args = configure(sys.argv[1:])[:2]
+    with tracing() as profiler:
+        main(*args, profiler=profiler, target_fps=settings.target_fps)
@@ -0,0 +1,39 @@
+import numpy as np
+
+# Whole-population motion rules shared by the array backends. Every function
+# works in place on (n, 2) position/velocity arrays and length n size arrays.
+
+
+def integrate(position, velocity, dt, moving=None):
+    if moving is None:
+        position += velocity * dt
+    else:
+        position += velocity * (dt * moving)[:, None]
+
+
+def decay(values, rate, dt, minimum=None):
+    values -= rate * dt
+    if minimum is not None:
+        np.maximum(values, minimum, out=values)
+
+
+def bounce(position, velocity, half_size, bounds):
+    # reflect anything poking out of bounds and still heading further out
+    x, y = position[:, 0], position[:, 1]
+    dx, dy = velocity[:, 0], velocity[:, 1]
+
+    bounce_x = ((x - half_size < bounds.left) & (dx < 0)) \
+        | ((x + half_size > bounds.right) & (dx > 0))
+    bounce_y = ((y - half_size < bounds.top) & (dy < 0)) \
+        | ((y + half_size > bounds.bottom) & (dy > 0))
+
+    dx *= 1 - 2 * bounce_x
+    dy *= 1 - 2 * bounce_y
+    return bounce_x | bounce_y
+
+
+def inside(position, half_size, bounds):
+    # True while any part of the particle is still within bounds
+    x, y = position[:, 0], position[:, 1]
+    return (x >= bounds.left - half_size) & (x <= bounds.right + half_size) \
+        & (y >= bounds.top - half_size) & (y <= bounds.bottom + half_size)
@@ -0,0 +1,27 @@
+import os
+import importlib.util
+
+here = os.path.dirname(os.path.abspath(__file__))
+demos = {
+    "HyperDrive": "HyperDrive.py",
+    "firework": "firework.py",
+    "falling-stars": "falling-stars.py",
+    "parallax": "parallax.py",
+}
+governed = ("firework", "falling-stars")  # demos whose main takes target_fps
+
+
+def load_demo(name):
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(here, demos[name]))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def start(name, module, backend="sprite", render="flip", target_fps=None, **kwargs):
+    # call a demo's main with whichever of the shared options it takes
+    if name == "parallax":
+        return module.main(**kwargs)
+    if name in governed:
+        return module.main(backend, render, target_fps=target_fps, **kwargs)
+    return module.main(backend, render, **kwargs)
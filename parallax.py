@@ -1,92 +1,140 @@
+# first, so the startup import phase includes pygame
+from common import Clock, Hooks, NullProfiler, SpriteCounter, startup, tracing
+
 import pygame
 import math
-from common import SpriteCounter
+import sys
+import assets
+from config import base_size, configure, settings
 
 
-class PlanePanel(pygame.sprite.Sprite):
-    containers = []
+class ScrollingLayer:
+    # A horizontally wrapping layer, tiled once into a strip one tile wider
+    # than the view so that any offset is a single blit out of the strip.
     def __init__(self, image, rect):
-        pygame.sprite.DirtySprite.__init__(self, self.containers)
-        self.image = image
-        self.rect = rect
-
-
-class Plane(pygame.sprite.RenderUpdates):
-
-    def __init__(self, image, rect, *containers):
-        pygame.sprite.RenderUpdates.__init__(self)
         self.image = image
         self.rect = rect
         self.offset = 0
 
-        self.panels = {}
+        self.tile = self.image.get_width()
+        tiles = math.ceil(self.rect.width/self.tile) + 1
+        self.strip = pygame.Surface((tiles*self.tile, self.image.get_height()), self.image.get_flags(), self.image)
+        for i in range(tiles):
+            # MAX onto the empty strip copies pixels exactly, alpha included
+            self.strip.blit(self.image, (i*self.tile, 0), special_flags=pygame.BLEND_RGBA_MAX)
 
-        for i in range(0, math.ceil(self.rect.width/self.image.get_width()) + 1):
-            panel = PlanePanel(self.image, pygame.Rect((self.rect.left + i*self.image.get_width(), self.rect.top), self.image.get_size()))
-            self.panels[i] = panel
-            self.add(panel)
+    def set_offset(self, offset):
+        self.offset = offset % self.tile
 
-        for x in containers:
-            containers.add(self)
+    def source_x(self):
+        # the strip column at the view's left edge, whole pixels only
+        return int(self.tile - self.offset)
 
-    def set_offset(self, offset):
-        self.offset = offset % self.image.get_width()
-        for i, panel in self.panels.items():
-            panel.rect = pygame.Rect((self.offset + self.rect.left + (i-1)*self.image.get_width(), self.rect.top), self.image.get_size())
-            panel.dirty = 1
+    def draw(self, surface):
+        area = pygame.Rect(self.source_x(), 0, self.rect.width, self.rect.height)
+        return surface.blit(self.strip, self.rect.topleft, area)
 
 
-def main():
-    pygame.init()
-    screen_rect = pygame.Rect((0, 0, 800, 600))
-    screen = pygame.display.set_mode(screen_rect.size)
+class LayerStack:
+    # Sky plus layers drawn back to front. The first `cached` layers are
+    # flattened with the sky into one opaque background, which is only
+    # rebuilt once one of them has moved by a whole pixel.
+    def __init__(self, rect, sky, layers, cached=0):
+        self.rect = rect
+        self.sky = pygame.Color(sky)
+        self.layers = layers
+        self.cached = cached
+
+        self.background = pygame.Surface(rect.size).convert()
+        self.background_key = None
+
+    def draw(self, surface):
+        key = tuple(layer.source_x() for layer in self.layers[:self.cached])
+        if key != self.background_key:
+            self.background.fill(self.sky)
+            for layer in self.layers[:self.cached]:
+                layer.draw(self.background)
+            self.background_key = key
+
+        surface.blit(self.background, self.rect)
+        for layer in self.layers[self.cached:]:
+            layer.draw(surface)
+
+
+def main(frames=None, profiler=None, hooks=None):
+    profiler = profiler or NullProfiler()
+    hooks = hooks or Hooks()
+
+    pygame.display.init()
+    screen = settings.set_mode()
+    screen_rect = screen.get_rect()
+    startup.mark("display")
     background = pygame.Surface(screen_rect.size)
     background.fill((0, 0, 0))
 
-    hills_back = pygame.image.load("hills_back.png").convert_alpha()
-    hills_mid = pygame.image.load("hills_mid.png").convert_alpha()
-    hills_front = pygame.image.load("hills_front.png").convert_alpha()
+    hills_back, hills_mid, hills_front = assets.load_layers(
+        "hills.svg", screen_rect.height, ("hills_back.png", "hills_mid.png", "hills_front.png"))
+    startup.mark("assets")
 
 
     counter = SpriteCounter()
 
-    plane1 = Plane(hills_back, screen_rect)
-    plane2 = Plane(hills_mid, screen_rect)
-    plane3 = Plane(hills_front, screen_rect)
+    plane1 = ScrollingLayer(hills_back, screen_rect)
+    plane2 = ScrollingLayer(hills_mid, screen_rect)
+    plane3 = ScrollingLayer(hills_front, screen_rect)
+    scene = LayerStack(screen_rect, "#7ec0ee", [plane1, plane2, plane3], cached=1)
 
 
     autoscroll = True
-
-    while 1:
-        if pygame.event.peek(pygame.QUIT):
-            pygame.quit()
-            raise SystemExit()
-
-        if pygame.key.get_pressed()[pygame.K_d] or autoscroll:
-            plane1.set_offset(plane1.offset + 0.25)
-            plane2.set_offset(plane2.offset + 0.5)
-            plane3.set_offset(plane3.offset + 1)
-        elif pygame.key.get_pressed()[pygame.K_a]:
-            plane1.set_offset(plane1.offset - 0.25)
-            plane2.set_offset(plane2.offset - 0.5)
-            plane3.set_offset(plane3.offset - 1)
+    startup.mark("setup")
+    clock = Clock()
+    frame = 0
+
+    while not pygame.event.peek(pygame.QUIT) and (frames is None or frame < frames):
+        hooks.begin_frame(frame)
+        profiler.begin_frame()
+        profiler.mark("events")
+
+        # one step scrolls as far as one frame used to at 60fps, in
+        # proportion to the screen height since the layers are scaled to it
+        speed = settings.height / base_size[1]
+        for step in range(clock.tick(hooks.frame_time())):
+            if pygame.key.get_pressed()[pygame.K_d] or autoscroll:
+                plane1.set_offset(plane1.offset + 0.25*speed)
+                plane2.set_offset(plane2.offset + 0.5*speed)
+                plane3.set_offset(plane3.offset + 1*speed)
+            elif pygame.key.get_pressed()[pygame.K_a]:
+                plane1.set_offset(plane1.offset - 0.25*speed)
+                plane2.set_offset(plane2.offset - 0.5*speed)
+                plane3.set_offset(plane3.offset - 1*speed)
         # for event in pygame.event.get(pygame.KEYDOWN):
         #     if event.unicode == "d":
         #         plane1.set_offset(plane1.offset + 1)
 
         pygame.event.clear()
+        profiler.mark("update")
 
-        screen.fill(pygame.Color("#7ec0ee"))
-        for plane in [plane1, plane2, plane3]:
-            # plane.clear(screen, background)
-            plane.update()
-            plane.draw(screen)
+        scene.draw(screen)
 
-        counter.update()
+        profiler.mark("draw")
+
+        counter.update(clock.frame_time)
         screen.blit(counter.image, counter.rect)
+        profiler.mark("hud")
 
         pygame.display.flip()
+        profiler.mark("present")
+        if frame == 0:
+            startup.mark("first frame")
+            print(startup.text())
+
+        hooks.end_frame(frame, screen)
+        frame += 1
+
+    print("Quitting...")
 
 
 if __name__ == "__main__":
-    main()
+    configure(sys.argv[1:])
+    with tracing() as profiler:
+        main(profiler=profiler)
@@ -0,0 +1,122 @@
+import os
+import atexit
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import pygame
+
+from particles import ParticleSystem
+
+
+# ParticleSystem whose arrays live in shared memory. Each tick the live rows
+# are split into one contiguous chunk per worker process and the workers
+# step their chunk in place, so only (dt, start, stop) crosses the pipes.
+# Spawning, compaction and drawing stay in the main process between ticks.
+class SharedParticleSystem(ParticleSystem):
+    def __init__(self, palette, bounds, capacity=1 << 17, workers=None, **rules):
+        self._shm = []
+        ParticleSystem.__init__(self, palette, bounds, capacity, **rules)
+
+        layout = {name: (array.shape, array.dtype.str, shm.name)
+                  for (name, array), shm in zip(self._arrays.items(), self._shm)}
+        state = {rule: getattr(self, rule) for rule in self.rules}
+        state["bounds"] = tuple(self.bounds)
+
+        context = multiprocessing.get_context("spawn")
+        self._workers = []
+        for n in range(workers or max(1, (os.cpu_count() or 2) - 1)):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker, args=(child_conn, layout, state), daemon=True)
+            process.start()
+            self._workers.append((process, conn))
+
+        atexit.register(self.close)
+
+    def _allocate(self, capacity):
+        if self._shm:
+            raise RuntimeError("shared particle buffers can't grow")
+
+        self._arrays = {}
+        for name, (width, dtype) in self.fields.items():
+            shape = (capacity, width) if width else (capacity,)
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._shm.append(shm)
+            array = self._arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            array[:] = 0
+        return self._arrays
+
+    def spawn(self, position, angle, speed, size, colour):
+        # fixed capacity: whatever doesn't fit after compacting is dropped
+        free = len(self.alive) - self.count
+        n = np.broadcast(angle, speed, size, colour).size
+        if n > free:
+            self.compact()
+            free = len(self.alive) - self.count
+            if n > free:
+                angle, speed, size, colour = (np.broadcast_to(a, (n,))[:free] for a in (angle, speed, size, colour))
+                if np.ndim(position) == 2:
+                    position = position[:free]
+        return ParticleSystem.spawn(self, position, angle, speed, size, colour)
+
+    def update_dt(self, dt):
+        if dt == 0 or self.count == 0:
+            return
+
+        n = self.count
+        chunks = np.linspace(0, n, len(self._workers) + 1).astype(int)
+        for (process, conn), start, stop in zip(self._workers, chunks, chunks[1:]):
+            conn.send((dt, int(start), int(stop)))
+        for process, conn in self._workers:
+            conn.recv()
+
+        if n > 64 and np.count_nonzero(self.alive[:n]) < n // 2:
+            self.compact()
+
+    def close(self):
+        for process, conn in self._workers:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process, conn in self._workers:
+            process.join(timeout=1)
+        self._workers = []
+
+        # drop our views before the buffers underneath them go away
+        for name in self.fields:
+            setattr(self, name, None)
+        self._arrays = {}
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
+
+
+def _worker(conn, layout, state):
+    buffers = []
+    system = ParticleSystem.__new__(ParticleSystem)
+    for name, (shape, dtype, shm_name) in layout.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        buffers.append(shm)
+        setattr(system, name, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+    for rule in ParticleSystem.rules:
+        setattr(system, rule, state[rule])
+    system.bounds = pygame.Rect(state["bounds"])
+
+    try:
+        while True:
+            job = conn.recv()
+            if job is None:
+                break
+            system.step(*job)
+            conn.send(True)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        for name in layout:
+            setattr(system, name, None)
+        for shm in buffers:
+            shm.close()
@@ -0,0 +1,216 @@
+import pygame
+import numpy as np
+
+import kinematics
+from tables import Palette
+from config import settings
+
+
+# Structure-of-arrays stand-in for a group of Debris/Star sprites: one row per
+# particle, so gravity, decay and bouncing are a few array ops per frame.
+class ParticleSystem:
+    fields = {
+        "position": (2, float),
+        "velocity": (2, float),
+        "size": (None, float),
+        "speed": (None, float),
+        "colour": (None, np.intp),
+        "alive": (None, bool),
+    }
+    rules = ("degrade_speed", "gravity", "edges")
+
+    degrade_speed = 3
+    gravity = 9.81*75  # 75px is a meter because YOLO
+    edges = "bounce"  # or "cull" to drop particles that leave the screen
+
+    def __init__(self, palette, bounds, capacity=1024, **rules):
+        for name, value in rules.items():
+            if name not in self.rules:
+                raise TypeError("'%s' is not a particle rule." % name)
+            setattr(self, name, value)
+
+        self.palette = palette if isinstance(palette, Palette) else Palette(palette)
+        self.bounds = pygame.Rect(bounds)
+        self.count = 0
+
+        for name, array in self._allocate(capacity).items():
+            setattr(self, name, array)
+
+        self._mapped = None
+        self._mapped_format = None
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive[:self.count]))
+
+    @property
+    def nbytes(self):
+        # everything allocated, used or not
+        return sum(getattr(self, name).nbytes for name in self.fields)
+
+    @property
+    def row_bytes(self):
+        return sum(getattr(self, name)[:1].nbytes for name in self.fields)
+
+    def _allocate(self, capacity):
+        return {
+            name: np.zeros((capacity, width) if width else capacity, dtype=dtype)
+            for name, (width, dtype) in self.fields.items()
+        }
+
+    def _grow(self, needed):
+        capacity = len(self.alive)
+        while capacity < needed:
+            capacity *= 2
+
+        for name, new in self._allocate(capacity).items():
+            new[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, new)
+
+    def close(self):
+        pass
+
+    def compact(self):
+        alive = self.alive[:self.count]
+        n = int(np.count_nonzero(alive))
+        for name in self.fields:
+            if name == "alive":
+                continue
+            arr = getattr(self, name)
+            arr[:n] = arr[:self.count][alive]
+        self.alive[:n] = True
+        self.alive[n:self.count] = False
+        self.count = n
+
+    def spawn(self, position, angle, speed, size, colour):
+        # every argument may be a scalar or an array
+        angle, speed, size, colour = np.broadcast_arrays(
+            np.asarray(angle, dtype=float),
+            np.asarray(speed, dtype=float),
+            np.asarray(size, dtype=float),
+            np.asarray(colour, dtype=np.intp),
+        )
+        n = angle.size
+        if n == 0:
+            return 0
+
+        if self.count + n > len(self.alive):
+            self.compact()
+            if self.count + n > len(self.alive):
+                self._grow(self.count + n)
+
+        s = slice(self.count, self.count + n)
+        radians = np.radians(angle.ravel())
+        self.position[s] = position
+        self.velocity[s, 0] = speed.ravel() * np.cos(radians)
+        self.velocity[s, 1] = speed.ravel() * np.sin(radians)
+        self.size[s] = size.ravel()
+        self.speed[s] = speed.ravel()
+        self.colour[s] = colour.ravel()
+        self.alive[s] = True
+        self.count += n
+        return n
+
+    def cull(self, n):
+        # kill the n smallest live particles
+        live = np.flatnonzero(self.alive[:self.count])
+        if n < len(live):
+            live = live[np.argpartition(self.size[live], n)[:n]]
+        self.alive[live] = False
+
+    def total_mass(self):
+        n = self.count
+        return float(np.sum(self.size[:n][self.alive[:n]] ** 2))
+
+    def update_dt(self, dt):
+        if dt == 0 or self.count == 0:
+            return
+
+        self.step(dt, 0, self.count)
+
+        n = self.count
+        if n > 64 and np.count_nonzero(self.alive[:n]) < n // 2:
+            self.compact()
+
+    def step(self, dt, start, stop):
+        # advance rows start:stop; rows never interact, so any split of the
+        # population can be stepped independently
+        alive = self.alive[start:stop]
+        size = self.size[start:stop]
+        speed = self.speed[start:stop]
+        pos = self.position[start:stop]
+        vel = self.velocity[start:stop]
+
+        if self.degrade_speed:
+            kinematics.decay(size, self.degrade_speed, dt)
+            kinematics.decay(speed, self.degrade_speed, dt, minimum=0)
+        alive &= size >= 1
+
+        if self.gravity:
+            vel[:, 1] += self.gravity * dt
+
+        kinematics.integrate(pos, vel, dt, moving=speed != 0)
+
+        if self.edges == "bounce":
+            kinematics.bounce(pos, vel, size / 2, self.bounds)
+        elif self.edges == "cull":
+            alive &= kinematics.inside(pos, size / 2, self.bounds)
+
+    def mapped_colours(self, surface):
+        fmt = (surface.get_bitsize(), surface.get_masks())
+        if fmt != self._mapped_format:
+            self._mapped = np.array(self.palette.mapped(surface), dtype=np.uint32)
+            self._mapped_format = fmt
+        return self._mapped
+
+    def draw(self, surface):
+        n = self.count
+        alive = self.alive[:n]
+        if not alive.any():
+            return pygame.Rect(0, 0, 0, 0)
+
+        # below the pixel threshold (or under a pixel) a particle is one
+        # pixel at its centre
+        size = np.maximum(self.size[:n][alive].astype(np.intp), 1)
+        size[size < settings.pixel_lod] = 1
+        pos = self.position[:n][alive]
+        colour = self.mapped_colours(surface)[self.colour[:n][alive]]
+
+        left = (pos[:, 0] - size / 2).astype(np.intp)
+        top = (pos[:, 1] - size / 2).astype(np.intp)
+        w, h = surface.get_size()
+
+        # drop anything fully off-screen, then write each size bucket as
+        # size*size shifted copies straight into the pixel buffer
+        visible = (left + size > 0) & (left < w) & (top + size > 0) & (top < h)
+        pixels = pygame.surfarray.pixels2d(surface)
+        for s in range(1, int(size.max()) + 1):
+            sel = visible & (size == s)
+            if not sel.any():
+                continue
+            x0, y0, c = left[sel], top[sel], colour[sel]
+            clipped = x0.min() < 0 or y0.min() < 0 or x0.max() + s > w or y0.max() + s > h
+            for offset_y in range(s):
+                y = y0 + offset_y
+                for offset_x in range(s):
+                    x = x0 + offset_x
+                    if clipped:
+                        inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+                        pixels[x[inside], y[inside]] = c[inside]
+                    else:
+                        pixels[x, y] = c
+        del pixels
+
+        dirty = pygame.Rect(
+            int(left.min()), int(top.min()),
+            int((left + size).max() - left.min()), int((top + size).max() - top.min())
+        )
+        return dirty.clip(surface.get_rect())
+
+
+def make_particle_system(backend, palette, bounds, **rules):
+    if backend == "numpy":
+        return ParticleSystem(palette, bounds, **rules)
+    elif backend == "parallel":
+        from parallel import SharedParticleSystem
+        return SharedParticleSystem(palette, bounds, **rules)
+    raise ValueError("'%s' is not a valid backend." % backend)
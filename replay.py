@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import random
+import struct
+import argparse
+
+from common import Hooks, seed_all, tracing  # first, so the import phase includes pygame
+
+import pygame
+
+import config
+import launcher
+from config import settings
+
+# Log layout, all little endian:
+#   header    magic, version, seed, length of the JSON metadata that follows
+#   per frame frame time (s), event count, then the events
+#   per event kind, then that kind's fields
+# A 60fps minute with no input is under 40KB.
+magic = b"BFRP"
+version = 1
+header = struct.Struct("<4sBQH")
+frame_header = struct.Struct("<dH")
+kinds = {
+    pygame.MOUSEBUTTONDOWN: (1, struct.Struct("<Bhh")),  # button, pos
+    pygame.MOUSEBUTTONUP: (2, struct.Struct("<Bhh")),
+    pygame.KEYDOWN: (3, struct.Struct("<iHI")),  # key, mod, unicode codepoint
+}
+kind_types = {kind: (event_type, fields) for event_type, (kind, fields) in kinds.items()}
+
+
+def pack_event(event):
+    kind, fields = kinds[event.type]
+    if kind == 3:
+        values = (event.key, event.mod, ord(event.unicode) if len(event.unicode) == 1 else 0)
+    else:
+        values = (event.button,) + tuple(event.pos)
+    return bytes((kind,)) + fields.pack(*values)
+
+
+def unpack_event(data, offset):
+    event_type, fields = kind_types[data[offset]]
+    values = fields.unpack_from(data, offset + 1)
+    if event_type == pygame.KEYDOWN:
+        key, mod, codepoint = values
+        event = pygame.event.Event(event_type, key=key, mod=mod, unicode=chr(codepoint) if codepoint else "")
+    else:
+        event = pygame.event.Event(event_type, button=values[0], pos=values[1:])
+    return event, offset + 1 + fields.size
+
+
+class Recorder(Hooks):
+    # Seeds every generator, then logs each frame's measured time and the
+    # input events the demo is about to read, so Replayer can rebuild the
+    # exact same run. Events that arrive after begin_frame but before the
+    # demo reads its queue are missed; in practice that window is a few
+    # microseconds a frame.
+    def __init__(self, path, seed=None, hooks=None, **metadata):
+        self.seed = random.SystemRandom().getrandbits(32) if seed is None else seed
+        self.hooks = hooks or Hooks()
+        self.file = open(path, "wb")
+        meta = json.dumps(metadata).encode()
+        self.file.write(header.pack(magic, version, self.seed, len(meta)) + meta)
+        self.events = []
+        self.last_time = None
+        seed_all(self.seed)
+
+    def begin_frame(self, frame):
+        self.hooks.begin_frame(frame)
+        events = pygame.event.get()
+        for event in events:
+            pygame.event.post(event)
+        self.events = [event for event in events if event.type in kinds]
+
+    def frame_time(self):
+        frame_time = self.hooks.frame_time()
+        cur_time = time.perf_counter()
+        if frame_time is None:
+            frame_time = 0 if self.last_time is None else cur_time - self.last_time
+        self.last_time = cur_time
+
+        self.file.write(frame_header.pack(frame_time, len(self.events)))
+        self.file.write(b"".join(pack_event(event) for event in self.events))
+        return frame_time
+
+    def end_frame(self, frame, screen):
+        self.hooks.end_frame(frame, screen)
+
+    def close(self):
+        self.file.close()
+
+
+class Replayer(Hooks):
+    # Feeds a recorded log back in: same seeds, same events on the same
+    # frames and the same frame times, however long frames really take.
+    # Run the demo for len() frames; nothing is posted to stop it, so the
+    # event queue is left clean for whatever runs next.
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+
+        found, log_version, self.seed, meta_length = header.unpack_from(data)
+        if found != magic or log_version != version:
+            raise ValueError("'%s' is not a valid replay log." % path)
+        offset = header.size
+        self.metadata = json.loads(data[offset:offset + meta_length].decode())
+        offset += meta_length
+
+        self.frames = []
+        while offset < len(data):
+            frame_time, count = frame_header.unpack_from(data, offset)
+            offset += frame_header.size
+            events = []
+            for n in range(count):
+                event, offset = unpack_event(data, offset)
+                events.append(event)
+            self.frames.append((frame_time, events))
+
+        self.frame = 0
+        seed_all(self.seed)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def begin_frame(self, frame):
+        self.frame = frame
+        pygame.event.clear(list(kinds))  # live input would make the run diverge
+        if frame < len(self.frames):
+            for event in self.frames[frame][1]:
+                pygame.event.post(event)
+
+    def frame_time(self):
+        if self.frame >= len(self.frames):
+            return 0
+        return self.frames[self.frame][0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record a demo run, or play one back exactly.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="play a demo and log it")
+    record.add_argument("demo", choices=list(launcher.demos))
+    record.add_argument("log")
+    record.add_argument("--seed", type=int)
+    record.add_argument("--backend", default="sprite", choices=["sprite", "numpy", "parallel"])
+    record.add_argument("--render", default="flip", choices=["flip", "dirty"])
+    config.add_arguments(record)
+    play = commands.add_parser("play", help="replay a log as fast as it will go")
+    play.add_argument("log")
+    play.add_argument("--trace", help="write a per-frame trace of the playback here (see --trace for record)")
+    args = parser.parse_args(argv)
+
+    args.log = os.path.abspath(args.log)
+    os.chdir(launcher.here)
+    # both run without the quality governor: it reacts to wall time, which
+    # a replay can't reproduce
+    if args.command == "record":
+        if args.target_fps is not None:
+            parser.error("--target-fps can't be recorded, the quality governor reacts to wall time")
+        config.apply(args)
+        module = launcher.load_demo(args.demo)
+        hooks = Recorder(args.log, args.seed, demo=args.demo, backend=args.backend, render=args.render,
+                         size=settings.size, density=settings.density)
+        try:
+            with tracing() as profiler:
+                launcher.start(args.demo, module, args.backend, args.render, target_fps=None, hooks=hooks,
+                               profiler=profiler)
+        finally:
+            hooks.close()
+    else:
+        if args.trace:
+            settings.trace = os.path.abspath(args.trace)
+        hooks = Replayer(args.log)
+        meta = hooks.metadata
+        # populations depend on the scene size, so play back at the recorded one
+        settings.resize(meta.get("size", settings.size))
+        settings.density = meta.get("density", settings.density)
+        module = launcher.load_demo(meta["demo"])
+        start = time.perf_counter()
+        with tracing() as profiler:
+            launcher.start(meta["demo"], module, meta["backend"], meta["render"], target_fps=None,
+                           frames=len(hooks), hooks=hooks, profiler=profiler)
+        wall = time.perf_counter() - start
+        print("replayed %i frames in %.2fs (%.0f fps)" % (len(hooks), wall, len(hooks) / wall))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import math
+
+
+# Uniform grid over sprite rects. Sprites are bucketed into every cell their
+# rect touches, and move() only rebuckets when that set of cells changes, so
+# keeping the index current costs next to nothing for slow sprites.
+class SpatialHash:
+    def __init__(self, cell_size=16):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.sprite_cells = {}
+
+    def __len__(self):
+        return len(self.sprite_cells)
+
+    def __contains__(self, sprite):
+        return sprite in self.sprite_cells
+
+    def _cells_for(self, rect):
+        size = self.cell_size
+        x0, x1 = rect.left // size, (rect.right - 1) // size
+        y0, y1 = rect.top // size, (rect.bottom - 1) // size
+        if x0 == x1 and y0 == y1:
+            return ((x0, y0),)
+        return tuple((x, y) for x in range(x0, max(x0, x1) + 1) for y in range(y0, max(y0, y1) + 1))
+
+    def insert(self, sprite):
+        if sprite in self.sprite_cells:
+            self.move(sprite)
+            return
+
+        keys = self._cells_for(sprite.rect)
+        self.sprite_cells[sprite] = keys
+        for key in keys:
+            self.cells.setdefault(key, set()).add(sprite)
+
+    def remove(self, sprite):
+        keys = self.sprite_cells.pop(sprite, ())
+        for key in keys:
+            cell = self.cells[key]
+            cell.discard(sprite)
+            if not cell:
+                del self.cells[key]
+
+    def move(self, sprite):
+        old = self.sprite_cells.get(sprite)
+        if old is None:
+            return
+
+        new = self._cells_for(sprite.rect)
+        if new == old:
+            return
+
+        self.remove(sprite)
+        self.sprite_cells[sprite] = new
+        for key in new:
+            self.cells.setdefault(key, set()).add(sprite)
+
+    def query(self, rect):
+        found = set()
+        for key in self._cells_for(rect):
+            found.update(self.cells.get(key, ()))
+        return found
+
+    def collide(self, sprite):
+        # grid equivalent of pygame.sprite.spritecollideany, ignoring sprite
+        rect = sprite.rect
+        for key in self.sprite_cells.get(sprite) or self._cells_for(rect):
+            for other in self.cells.get(key, ()):
+                if other is not sprite and rect.colliderect(other.rect):
+                    return other
+        return None
+
+    def nearest(self, position, radius, exclude=None):
+        x, y = position
+        reach = int(math.ceil(radius))
+        best, best_distance = None, radius
+        cx, cy = int(x) // self.cell_size, int(y) // self.cell_size
+        span = reach // self.cell_size + 1
+
+        seen = set()
+        for gx in range(cx - span, cx + span + 1):
+            for gy in range(cy - span, cy + span + 1):
+                for other in self.cells.get((gx, gy), ()):
+                    if other is exclude or other in seen:
+                        continue
+                    seen.add(other)
+                    ox, oy = other.rect.center
+                    distance = math.hypot(ox - x, oy - y)
+                    if distance <= best_distance:
+                        best, best_distance = other, distance
+        return best